@@ -0,0 +1,80 @@
+'''
+  Build RigDFU images from hex files in memory, once per distinct input
+
+  ImageBuilder runs the same generation as genimage.py without writing a
+  .bin, and keeps each result keyed by a hash of the hex files' contents,
+  the family config and the generation options.  Asking for the same build
+  again, e.g. once per port in a fleet update, returns the cached image.
+
+  @copyright (c) Rigado, LLC. All rights reserved.
+
+  Source code licensed under BMD Software License Agreement.
+  You should have received a copy with purchase of Rigado product.
+  If not, contact info@rigado.com for for a copy.
+'''
+
+import configparser
+import hashlib
+import os
+import sys
+
+_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.append(os.path.join(_root, "tools"))
+
+import tupperware
+from rigdfugen import RigDfuGen, RigError
+
+#where genimage keeps the family configs
+CONFIG_DIR = os.path.join(_root, "image-tools", "genimage", "config")
+
+def findFamily(family):
+    """Path of a family config, given as a path or as a name in CONFIG_DIR."""
+    for path in (family, os.path.join(CONFIG_DIR, family), os.path.join(CONFIG_DIR, family + ".cfg")):
+        if os.path.isfile(path):
+            return path
+    raise RigError("Device not supported: " + family)
+
+def loadFamily(path):
+    config = configparser.ConfigParser()
+    config.read(path)
+    return tupperware.tupperware(config._sections)
+
+class ImageBuilder(object):
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.images = {}
+        self.builds = 0
+
+    def key(self, hexfiles, family, options):
+        """Hash of everything the generated image depends on."""
+        digest = hashlib.sha256()
+        for path in [family] + list(hexfiles):
+            with open(path, "rb") as f:
+                data = f.read()
+            digest.update(len(data).to_bytes(8, 'little'))
+            digest.update(data)
+        digest.update(repr(sorted(options.items())).encode("utf-8"))
+        return digest.hexdigest()
+
+    def build(self, hexfiles, family, sd=False, bl=False, app=False,
+              sd_addr=None, bl_addr=None, app_addr=None):
+        """Return the packed, unencrypted image genimage would write."""
+        if not hexfiles:
+            raise RigError("no hex files given")
+        for path in hexfiles:
+            if not os.path.isfile(path):
+                raise RigError("hex file not found: " + path)
+
+        family = findFamily(family)
+        options = dict(sd=sd, bl=bl, app=app, sd_addr=sd_addr, bl_addr=bl_addr, app_addr=app_addr)
+        key = self.key(hexfiles, family, options)
+
+        image = self.images.get(key)
+        if image is None:
+            gen = RigDfuGen(inputs=list(hexfiles), config=loadFamily(family),
+                            verbose=self.verbose, **options)
+            image = gen.gen_image()
+            self.images[key] = image
+            self.builds += 1
+        return image
@@ -2,6 +2,9 @@ import sys
 import binascii
 import re
 
+class RigError(Exception):
+    pass
+
 def int2byte(i):
     if sys.version_info < (3,):
         return chr(i)
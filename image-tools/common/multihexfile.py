@@ -1,8 +1,10 @@
+import os
 import sys
 import struct
+from bisect import bisect_left, bisect_right
 from imageutils import *
 
-sys.path.append('../../tools')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'tools'))
 
 import ihex
 
@@ -10,40 +12,66 @@ class MultiHexFile(object):
     """Some tools to help manage multiple hex files and pull padded regions of
     data out of them."""
     def __init__(self, hexfiles, pad):
-        self.data = ihex.IHex();
+        # Collect every area of every file, then merge them in one sweep
+        # over the areas sorted by address
+        areas = []
         for hexfile in hexfiles:
             ih = ihex.IHex.read_file(hexfile)
-            # Combine new file with self.data
-            for start, data in sorted(ih.areas.items()):
-                end = start + len(data)
-                if start == end:
+            areas.extend((start, start + len(data), data, hexfile)
+                         for start, data in ih.areas.items() if data)
+        areas.sort(key = lambda area: area[:2])
+
+        merged = []
+        last = None
+        for area in areas:
+            start, end, data, hexfile = area
+            if last is not None and start < last[1]:
+                # Don't complain if the overlapping data is the same
+                if (start, end, data) == last[:3]:
                     continue
-                # Check for overlap
-                for ostart, odata in sorted(self.data.areas.items()):
-                    oend = ostart + len(odata)
-                    if start < oend and end >= ostart:
-                        # Don't complain if the overlapping data is the same
-                        if start == ostart and end == oend and data == odata:
-                            continue
-                        raise RigError(("data region [%x-%x] in %s "
-                                        "overlaps earlier data") %
-                                       (start, end, hexfile))
-                self.data.insert_data(start, data)
+                raise RigError(("data region [%x-%x] in %s "
+                                "overlaps [%x-%x] in %s") %
+                               (start, end, hexfile, last[0], last[1], last[3]))
+            # Coalesce areas that follow on from each other
+            if merged and merged[-1][1] == start:
+                merged[-1][1] = end
+                merged[-1][2].append(data)
+            else:
+                merged.append([start, end, [data]])
+            last = area
+
+        self.data = ihex.IHex();
+        for start, end, chunks in merged:
+            # A lone area is kept as it is, which may be a view of the
+            # hex cache
+            self.data.areas[start] = chunks[0] if len(chunks) == 1 else b''.join(chunks)
+        self.index()
+
+    def index(self):
+        """Build the sorted interval index used by the range queries.
+        Call again if self.data is changed."""
+        areas = sorted(self.data.areas.items())
+        self.starts = [start for start, data in areas]
+        self.ends = [start + len(data) for start, data in areas]
+        self.blocks = [data for start, data in areas]
+
+    def overlapping(self, minaddr, maxaddr):
+        """Return the range of area indexes that overlap
+        'minaddr' to 'maxaddr'."""
+        # Areas don't overlap, so their ends are sorted too
+        first = bisect_right(self.ends, minaddr)
+        last = bisect_left(self.starts, maxaddr)
+        return range(first, max(first, last))
 
     def extents(self, minaddr, maxaddr, round = 4):
         """Return a tuple containing the extents of data that are
         present between 'minaddr' and 'maxaddr'.  Addresses are
         rounded to 'round' bytes."""
-        ext_min = None
-        ext_max = None
-        for start, data in sorted(self.data.areas.items()):
-            end = start + len(data)
-            if minaddr < end and ext_min is None:
-                ext_min = max(minaddr, start)
-            if maxaddr > start and ext_min is not None:
-                ext_max = min(maxaddr, end)
-        if ext_min is None or ext_max is None:
+        areas = self.overlapping(minaddr, maxaddr)
+        if not areas:
             return (None, None)
+        ext_min = max(minaddr, self.starts[areas[0]])
+        ext_max = min(maxaddr, self.ends[areas[-1]])
         def round_down(x, n):
             return x - (x % n)
         ext_min = round_down(ext_min, round)
@@ -51,24 +79,20 @@ class MultiHexFile(object):
         return (ext_min, ext_max)
 
     def extract(self, minaddr, maxaddr, pad = 0xff):
-        """Return all data in the specified range, padding missing values"""
-        buf = b''
-        addr = minaddr
-        for start, data in sorted(self.data.areas.items()):
-            end = start + len(data)
-            if addr > end:
-                continue
-            if maxaddr <= start:
-                continue
-            if addr < start:
-                buf += int2byte(pad) * (start - addr)
-                addr = start
-            if end > maxaddr:
-                end = maxaddr
-            buf += data[addr-start:end-start]
-            addr = end
-        buf += int2byte(pad) * (maxaddr - addr)
+        """Return all data in the specified range, padding missing values.
+        The result is a bytearray, filled in place."""
+        buf = bytearray(int2byte(pad)) * max(0, maxaddr - minaddr)
+        with memoryview(buf) as view:
+            for i in self.overlapping(minaddr, maxaddr):
+                start = max(minaddr, self.starts[i])
+                end = min(maxaddr, self.ends[i])
+                with memoryview(self.blocks[i]) as data:
+                    view[start-minaddr:end-minaddr] = data[start-self.starts[i]:end-self.starts[i]]
         return buf
 
     def uint32le(self, addr):
-        return struct.unpack("<I", self.extract(addr, addr+4))[0]
\ No newline at end of file
+        # Usually all four bytes are in one area
+        i = bisect_right(self.starts, addr) - 1
+        if i >= 0 and addr + 4 <= self.ends[i]:
+            return struct.unpack_from("<I", self.blocks[i], addr - self.starts[i])[0]
+        return struct.unpack("<I", self.extract(addr, addr+4))[0]
@@ -0,0 +1,235 @@
+'''
+  AES-128 EAX encryption of RigDFU images, compatible with signimage
+
+  An image as generated by genimage is laid out as:
+
+    uint32_t[3] - segment lengths (sd, bl, app), little-endian
+    uint8_t[16] - iv, zero until encrypted
+    uint8_t[16] - tag, zero until encrypted
+    uint8_t[N]  - image data, N is the sum of the segment lengths
+
+  signImage() fills in a random iv, encrypts the image data in place and
+  stores the EAX tag; the segment lengths are authenticated as the header.
+
+  pycryptodome is used when it is installed, otherwise a pure Python
+  AES-128 is used.
+
+  @copyright (c) Rigado, LLC. All rights reserved.
+
+  Source code licensed under BMD Software License Agreement.
+  You should have received a copy with purchase of Rigado product.
+  If not, contact info@rigado.com for for a copy.
+'''
+
+import os
+import struct
+
+try:
+    from Crypto.Cipher import AES as _AES
+except ImportError:
+    _AES = None
+
+KEY_SZ = 16
+BLOCK_SZ = 16
+META_SZ = 12
+IV_SZ = 16
+TAG_SZ = 16
+HEADER_SZ = META_SZ + IV_SZ + TAG_SZ
+
+class SignError(Exception):
+    pass
+
+def _xtime(b):
+    b <<= 1
+    return (b ^ 0x11B) if b & 0x100 else b
+
+def _buildTables():
+    #inverses via exp/log tables over generator 3
+    exp = [0] * 255
+    log = [0] * 256
+    x = 1
+    for i in range(255):
+        exp[i] = x
+        log[x] = i
+        x ^= _xtime(x)
+
+    sbox = [0] * 256
+    for i in range(256):
+        inv = exp[(255 - log[i]) % 255] if i else 0
+        s = inv
+        for shift in range(1, 5):
+            s ^= ((inv << shift) | (inv >> (8 - shift))) & 0xFF
+        sbox[i] = s ^ 0x63
+
+    te = []
+    for s in sbox:
+        s2 = _xtime(s)
+        te.append((s2 << 24) | (s << 16) | (s << 8) | (s2 ^ s))
+
+    ror = lambda w, n: ((w >> n) | (w << (32 - n))) & 0xFFFFFFFF
+    return (sbox, te, [ror(w, 8) for w in te], [ror(w, 16) for w in te],
+            [ror(w, 24) for w in te])
+
+_SBOX, _TE0, _TE1, _TE2, _TE3 = _buildTables()
+
+class AES128(object):
+    """Table driven AES-128, encryption direction only (all EAX needs)."""
+
+    def __init__(self, key):
+        if len(key) != KEY_SZ:
+            raise SignError("key must be {} bytes".format(KEY_SZ))
+
+        sbox = _SBOX
+        rk = list(struct.unpack('>4I', bytes(key)))
+        rcon = 1
+        for i in range(4, 44):
+            t = rk[i - 1]
+            if i % 4 == 0:
+                t = ((sbox[(t >> 16) & 0xFF] << 24) | (sbox[(t >> 8) & 0xFF] << 16) |
+                     (sbox[t & 0xFF] << 8) | sbox[t >> 24]) ^ (rcon << 24)
+                rcon = _xtime(rcon)
+            rk.append(rk[i - 4] ^ t)
+        self.rk = rk
+
+    def encryptInt(self, block):
+        """Encrypt one block given and returned as a 128-bit big-endian int."""
+        rk = self.rk
+        te0, te1, te2, te3 = _TE0, _TE1, _TE2, _TE3
+
+        s0 = (block >> 96) ^ rk[0]
+        s1 = ((block >> 64) & 0xFFFFFFFF) ^ rk[1]
+        s2 = ((block >> 32) & 0xFFFFFFFF) ^ rk[2]
+        s3 = (block & 0xFFFFFFFF) ^ rk[3]
+
+        for k in range(4, 40, 4):
+            s0, s1, s2, s3 = (
+                te0[s0 >> 24] ^ te1[(s1 >> 16) & 0xFF] ^ te2[(s2 >> 8) & 0xFF] ^ te3[s3 & 0xFF] ^ rk[k],
+                te0[s1 >> 24] ^ te1[(s2 >> 16) & 0xFF] ^ te2[(s3 >> 8) & 0xFF] ^ te3[s0 & 0xFF] ^ rk[k + 1],
+                te0[s2 >> 24] ^ te1[(s3 >> 16) & 0xFF] ^ te2[(s0 >> 8) & 0xFF] ^ te3[s1 & 0xFF] ^ rk[k + 2],
+                te0[s3 >> 24] ^ te1[(s0 >> 16) & 0xFF] ^ te2[(s1 >> 8) & 0xFF] ^ te3[s2 & 0xFF] ^ rk[k + 3])
+
+        sbox = _SBOX
+        out = 0
+        for a, b, c, d, k in ((s0, s1, s2, s3, rk[40]), (s1, s2, s3, s0, rk[41]),
+                              (s2, s3, s0, s1, rk[42]), (s3, s0, s1, s2, rk[43])):
+            word = ((sbox[a >> 24] << 24) | (sbox[(b >> 16) & 0xFF] << 16) |
+                    (sbox[(c >> 8) & 0xFF] << 8) | sbox[d & 0xFF]) ^ k
+            out = (out << 32) | word
+        return out
+
+    def encryptBlock(self, block):
+        return self.encryptInt(int.from_bytes(block, 'big')).to_bytes(BLOCK_SZ, 'big')
+
+def _double(x):
+    x <<= 1
+    if x >> 128:
+        x ^= (1 << 128) | 0x87
+    return x
+
+def _omac(cipher, tweak, data):
+    """CMAC of the tweak block [tweak]_16 followed by 'data'."""
+    k1 = _double(cipher.encryptInt(0))
+    k2 = _double(k1)
+
+    #the tweak block is the last, complete block when there's no data
+    if len(data) == 0:
+        return cipher.encryptInt(tweak ^ k1)
+
+    mac = cipher.encryptInt(tweak)
+
+    last = (len(data) - 1) // BLOCK_SZ * BLOCK_SZ
+    for i in range(0, last, BLOCK_SZ):
+        mac = cipher.encryptInt(mac ^ int.from_bytes(data[i:i + BLOCK_SZ], 'big'))
+
+    tail = bytes(data[last:])
+    if len(tail) == BLOCK_SZ:
+        mac ^= int.from_bytes(tail, 'big') ^ k1
+    else:
+        tail += b'\x80' + bytes(BLOCK_SZ - len(tail) - 1)
+        mac ^= int.from_bytes(tail, 'big') ^ k2
+    return cipher.encryptInt(mac)
+
+def _ctr(cipher, counter, data):
+    blocks = (len(data) + BLOCK_SZ - 1) // BLOCK_SZ
+    stream = b''.join(cipher.encryptInt((counter + i) & ((1 << 128) - 1)).to_bytes(BLOCK_SZ, 'big')
+                      for i in range(blocks))
+    if not data:
+        return b''
+    out = int.from_bytes(data, 'big') ^ int.from_bytes(stream[:len(data)], 'big')
+    return out.to_bytes(len(data), 'big')
+
+def _eax(key, nonce, header, data, encrypt):
+    cipher = AES128(key)
+    n = _omac(cipher, 0, nonce)
+    h = _omac(cipher, 1, header)
+    if encrypt:
+        out = _ctr(cipher, n, data)
+        c = _omac(cipher, 2, out)
+    else:
+        c = _omac(cipher, 2, data)
+        out = _ctr(cipher, n, data)
+    return out, (n ^ h ^ c).to_bytes(TAG_SZ, 'big')
+
+def eaxEncrypt(key, nonce, header, plaintext):
+    """AES-128 EAX encrypt 'plaintext'; returns (ciphertext, 16 byte tag)."""
+    if len(key) != KEY_SZ:
+        raise SignError("key must be {} bytes".format(KEY_SZ))
+    if _AES is not None:
+        cipher = _AES.new(bytes(key), _AES.MODE_EAX, nonce=bytes(nonce), mac_len=TAG_SZ)
+        cipher.update(bytes(header))
+        return cipher.encrypt_and_digest(bytes(plaintext))
+    return _eax(key, nonce, header, plaintext, True)
+
+def eaxDecrypt(key, nonce, header, ciphertext, tag):
+    """AES-128 EAX decrypt 'ciphertext'; raises SignError if 'tag' doesn't match."""
+    if len(key) != KEY_SZ:
+        raise SignError("key must be {} bytes".format(KEY_SZ))
+    if _AES is not None:
+        cipher = _AES.new(bytes(key), _AES.MODE_EAX, nonce=bytes(nonce), mac_len=TAG_SZ)
+        cipher.update(bytes(header))
+        try:
+            return cipher.decrypt_and_verify(bytes(ciphertext), bytes(tag))
+        except ValueError:
+            raise SignError("tag mismatch, wrong key or corrupted image")
+
+    plaintext, expected = _eax(key, nonce, header, ciphertext, False)
+    if expected != bytes(tag):
+        raise SignError("tag mismatch, wrong key or corrupted image")
+    return plaintext
+
+def _splitImage(image):
+    if len(image) < HEADER_SZ:
+        raise SignError("failed to read meta")
+
+    meta = bytes(image[:META_SZ])
+    dataSz = sum(struct.unpack('<3I', meta))
+    if len(image) - HEADER_SZ < dataSz:
+        raise SignError("failed to read {} bytes of image data".format(dataSz))
+    if len(image) - HEADER_SZ > dataSz:
+        raise SignError("extraneous data at end of file")
+
+    iv = bytes(image[META_SZ:META_SZ + IV_SZ])
+    tag = bytes(image[META_SZ + IV_SZ:HEADER_SZ])
+    return meta, iv, tag, image[HEADER_SZ:]
+
+def signImage(image, key, iv=None):
+    """Encrypt an unencrypted genimage image, as signimage does.
+
+    A random iv is used unless one is given."""
+    meta, oldIv, oldTag, data = _splitImage(image)
+    if any(oldIv) or any(oldTag):
+        raise SignError("IV or tag != 0; is the input already encrypted?")
+
+    if iv is None:
+        iv = os.urandom(IV_SZ)
+    elif len(iv) != IV_SZ:
+        raise SignError("iv must be {} bytes".format(IV_SZ))
+
+    ciphertext, tag = eaxEncrypt(key, iv, meta, data)
+    return meta + bytes(iv) + bytes(tag) + bytes(ciphertext)
+
+def unsignImage(image, key):
+    """Decrypt and verify an image produced by signImage() or signimage."""
+    meta, iv, tag, data = _splitImage(image)
+    plaintext = eaxDecrypt(key, iv, meta, data, tag)
+    return meta + bytes(IV_SZ + TAG_SZ) + bytes(plaintext)
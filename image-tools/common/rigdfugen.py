@@ -7,9 +7,6 @@ from imageutils import *
 from multihexfile import MultiHexFile
 from utils import Utils
 
-class RigError(Exception):
-    pass
-
 class RigDfuGen(object):
 
     def __init__(self, inputs, sd, bl, app, sd_addr, bl_addr, app_addr, config,
@@ -0,0 +1,296 @@
+'''
+  Binary patches for RigDFU application updates
+
+  A patch file is laid out as dfu.py and dfu.js expect it:
+
+    uint8_t[16] - patch key, marks the file as a patch
+    uint32_t[3] - start packet: segment lengths (0, 0, new app length)
+    uint8_t[16] - iv, zero (unencrypted)
+    uint8_t[16] - tag, zero (unencrypted)
+    uint32_t[3] - patch init packet: patch data length, CRC-32 of the new
+                  application, CRC-32 of the old application
+    uint8_t[N]  - patch data
+
+  The patch data is a JojoDiff style operation stream, as read by janpatch.
+  Each operation starts with ESC (0xA7) followed by an opcode:
+
+    MOD (0xA6) <data>   data replaces the old bytes, both advance
+    INS (0xA5) <data>   data is inserted, the old position stays
+    DEL (0xA4) <len>    skip 'len' old bytes
+    EQL (0xA3) <len>    copy 'len' old bytes
+    BKT (0xA2) <len>    move the old position back 'len' bytes
+
+  A literal 0xA7 in <data> is written as ESC ESC.  Lengths are 1 byte for
+  1-252 (value - 1), 252 followed by one byte for 253-508 (value - 253),
+  253 followed by a big-endian uint16 up to 65535, and 254 followed by a
+  big-endian uint32 otherwise.  CRCs are zlib's CRC-32.
+
+  checkPatch() applies a patch file with the checks the bootloader makes.
+
+  @copyright (c) Rigado, LLC. All rights reserved.
+
+  Source code licensed under BMD Software License Agreement.
+  You should have received a copy with purchase of Rigado product.
+  If not, contact info@rigado.com for for a copy.
+'''
+
+from collections import namedtuple
+import struct
+import zlib
+
+PATCH_KEY = bytes((0xac, 0xb3, 0x37, 0xe8, 0xd0, 0xeb, 0x40, 0x90,
+                   0xa4, 0xf3, 0xbb, 0x85, 0x7a, 0x5b, 0x2a, 0xf6))
+
+ESC = 0xA7
+MOD = 0xA6
+INS = 0xA5
+DEL = 0xA4
+EQL = 0xA3
+BKT = 0xA2
+
+#old bytes hashed per match candidate, and the shortest match worth using
+BLOCK_SZ = 8
+MIN_MATCH = 8
+
+#candidates kept per block, so runs of padding don't make the search quadratic
+MAX_CANDIDATES = 16
+
+#bytes ahead of the patch data in a patch file
+FILE_HEADER_SZ = 16 + 12 + 32 + 12
+
+#a patch file split into its packets; startPkt is (sd, bl, app) lengths
+PatchFile = namedtuple('PatchFile', 'startPkt patchLen newCrc oldCrc data')
+
+#counts of each operation and the bytes they carry
+PatchStats = namedtuple('PatchStats', 'oldLen oldCrc newLen newCrc patchLen equal modified inserted deleted backtracked ops')
+
+class PatchError(Exception):
+    pass
+
+def crc32(data):
+    return zlib.crc32(data) & 0xFFFFFFFF
+
+def encodeLength(n):
+    if n < 1:
+        raise PatchError("illegal length {}".format(n))
+    if n <= 252:
+        return bytes((n - 1,))
+    if n <= 508:
+        return bytes((252, n - 253))
+    if n <= 0xFFFF:
+        return bytes((253,)) + struct.pack('>H', n)
+    return bytes((254,)) + struct.pack('>I', n)
+
+class _Writer(object):
+
+    def __init__(self):
+        self.out = bytearray()
+        self.counts = dict(equal=0, modified=0, inserted=0, deleted=0, backtracked=0, ops=0)
+
+    def op(self, code, length=None):
+        self.out += bytes((ESC, code))
+        if length is not None:
+            self.out += encodeLength(length)
+        self.counts['ops'] += 1
+
+    def data(self, code, data):
+        self.op(code)
+        self.out += bytes(data).replace(b'\xa7', b'\xa7\xa7')
+        self.counts['modified' if code == MOD else 'inserted'] += len(data)
+
+    def move(self, src, pos):
+        if pos > src:
+            self.op(DEL, pos - src)
+            self.counts['deleted'] += pos - src
+        elif pos < src:
+            self.op(BKT, src - pos)
+            self.counts['backtracked'] += src - pos
+
+    def equal(self, length):
+        #the length encoding stops at 32 bits
+        while length:
+            n = min(length, 0xFFFFFFFF)
+            self.op(EQL, n)
+            self.counts['equal'] += n
+            length -= n
+
+def _matchLength(old, i, new, j):
+    """Length of the common run starting at old[i] and new[j]."""
+    n = 0
+    limit = min(len(old) - i, len(new) - j)
+    #compare in blocks, then bytes
+    step = 64
+    while n + step <= limit and old[i + n:i + n + step] == new[j + n:j + n + step]:
+        n += step
+    while n < limit and old[i + n] == new[j + n]:
+        n += 1
+    return n
+
+def diff(old, new):
+    """Operation stream turning 'old' into 'new'; returns (patch data, PatchStats)."""
+    old = bytes(old)
+    new = bytes(new)
+
+    index = {}
+    for i in range(0, len(old) - BLOCK_SZ + 1):
+        candidates = index.setdefault(old[i:i + BLOCK_SZ], [])
+        if len(candidates) < MAX_CANDIDATES:
+            candidates.append(i)
+
+    writer = _Writer()
+    literal = bytearray()
+    src = 0
+    j = 0
+
+    def flushLiteral():
+        nonlocal src
+        if not literal:
+            return
+        #replace old bytes while there are any, insert the rest
+        modLen = max(0, min(len(literal), len(old) - src))
+        if modLen:
+            writer.data(MOD, literal[:modLen])
+            src += modLen
+        if modLen < len(literal):
+            writer.data(INS, literal[modLen:])
+        del literal[:]
+
+    while j < len(new):
+        #staying in step with the old image is cheapest, try that first
+        bestPos = src + len(literal)
+        bestLen = _matchLength(old, bestPos, new, j) if bestPos < len(old) else 0
+
+        if bestLen < MIN_MATCH:
+            for pos in index.get(new[j:j + BLOCK_SZ], ()):
+                length = _matchLength(old, pos, new, j)
+                if length > bestLen:
+                    bestPos, bestLen = pos, length
+
+        if bestLen < MIN_MATCH:
+            literal.append(new[j])
+            j += 1
+            continue
+
+        #modified bytes in step with the old image go out as MOD
+        flushLiteral()
+        writer.move(src, bestPos)
+        writer.equal(bestLen)
+        src = bestPos + bestLen
+        j += bestLen
+
+    flushLiteral()
+
+    stats = PatchStats(len(old), crc32(old), len(new), crc32(new), len(writer.out), **writer.counts)
+    return bytes(writer.out), stats
+
+def _readLength(patch, i):
+    if i >= len(patch):
+        raise PatchError("truncated length at {}".format(i))
+    b = patch[i]
+    if b <= 251:
+        return b + 1, i + 1
+    if b == 252:
+        return patch[i + 1] + 253, i + 2
+    if b == 253:
+        return struct.unpack('>H', patch[i + 1:i + 3])[0], i + 3
+    if b == 254:
+        return struct.unpack('>I', patch[i + 1:i + 5])[0], i + 5
+    raise PatchError("illegal length byte 0x{:02x} at {}".format(b, i))
+
+def apply(old, patch):
+    """Run the operation stream 'patch' over 'old' and return the new image."""
+    old = bytes(old)
+    patch = bytes(patch)
+    out = bytearray()
+    src = 0
+    mode = None
+    i = 0
+
+    try:
+        while i < len(patch):
+            b = patch[i]
+            i += 1
+
+            if b == ESC and i < len(patch):
+                code = patch[i]
+                if code == ESC:
+                    #escaped literal
+                    i += 1
+                elif code in (MOD, INS):
+                    mode = code
+                    i += 1
+                    continue
+                elif code in (DEL, EQL, BKT):
+                    length, i = _readLength(patch, i + 1)
+                    if code == EQL:
+                        if src + length > len(old):
+                            raise PatchError("copy past the end of the old image")
+                        out += old[src:src + length]
+                        src += length
+                    elif code == DEL:
+                        src += length
+                    else:
+                        src -= length
+                    if src < 0 or src > len(old):
+                        raise PatchError("old image position {} out of range".format(src))
+                    mode = None
+                    continue
+
+            if mode is None:
+                raise PatchError("data byte outside MOD/INS at {}".format(i - 1))
+            out.append(b)
+            if mode == MOD:
+                src += 1
+    except struct.error:
+        raise PatchError("truncated length")
+
+    return bytes(out)
+
+def packPatch(old, new, patchData):
+    """Wrap patch data in the file layout dfu.py and dfu.js read."""
+    if len(new) % 4:
+        raise PatchError("new image length must be a multiple of 4")
+    startPkt = struct.pack('<3I', 0, 0, len(new))
+    initPkt = bytes(32)
+    patchInitPkt = struct.pack('<3I', len(patchData), crc32(new), crc32(old))
+    return PATCH_KEY + startPkt + initPkt + patchInitPkt + patchData
+
+def makePatch(old, new):
+    """Diff two application images; returns (patch file, PatchStats)."""
+    patchData, stats = diff(old, new)
+    if apply(old, patchData) != bytes(new):
+        raise PatchError("generated patch doesn't reproduce the new image")
+    return packPatch(old, new, patchData), stats
+
+def parsePatch(patchFile):
+    """Split a patch file into a PatchFile, checking its key and lengths."""
+    patchFile = bytes(patchFile)
+    if len(patchFile) < FILE_HEADER_SZ:
+        raise PatchError("file too short for a patch")
+    if patchFile[:16] != PATCH_KEY:
+        raise PatchError("no patch key, not a patch file")
+
+    startPkt = struct.unpack('<3I', patchFile[16:28])
+    patchLen, newCrc, oldCrc = struct.unpack('<3I', patchFile[60:72])
+    data = patchFile[FILE_HEADER_SZ:]
+    if startPkt[0] or startPkt[1]:
+        raise PatchError("patches can only update the application")
+    if patchLen != len(data):
+        raise PatchError("patch init packet gives {} bytes of patch data, file has {}".format(patchLen, len(data)))
+    return PatchFile(startPkt, patchLen, newCrc, oldCrc, data)
+
+def checkPatch(old, patchFile):
+    """Apply a patch file to 'old' as the bootloader does; returns the new image.
+
+    Raises PatchError if the file is malformed, 'old' isn't the image the
+    patch was made for, or the result doesn't match the patch init packet."""
+    patch = parsePatch(patchFile)
+    if crc32(old) != patch.oldCrc:
+        raise PatchError("old application crc32 {:08x}, patch is for {:08x}".format(crc32(old), patch.oldCrc))
+
+    new = apply(old, patch.data)
+    if len(new) != patch.startPkt[2]:
+        raise PatchError("patched application is {} bytes, start packet gives {}".format(len(new), patch.startPkt[2]))
+    if crc32(new) != patch.newCrc:
+        raise PatchError("patched application crc32 {:08x}, expected {:08x}".format(crc32(new), patch.newCrc))
+    return new
@@ -0,0 +1,136 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+#multihexfile puts tools on the path for ihex, intelhex and hexcache
+from multihexfile import MultiHexFile
+from test_multihexfile import hexText
+import hexcache
+import ihex
+import intelhex
+
+BINARIES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "programming", "binaries")
+SOFTDEVICE = os.path.join(BINARIES, "s132_nrf52_3.1.0_softdevice.hex")
+BOOTLOADER = os.path.join(BINARIES, "rigdfu2_nrf52_s132_sdk12_rel_3.3.1.46.hex")
+
+class TestHexCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.useCache(os.path.join(self.dir, "cache"))
+
+    def useCache(self, value):
+        old = os.environ.get("RIGADO_HEX_CACHE")
+        os.environ["RIGADO_HEX_CACHE"] = value
+        def restore():
+            if old is None:
+                os.environ.pop("RIGADO_HEX_CACHE", None)
+            else:
+                os.environ["RIGADO_HEX_CACHE"] = old
+        self.addCleanup(restore)
+
+    def copy(self, path):
+        dest = os.path.join(self.dir, os.path.basename(path))
+        shutil.copy(path, dest)
+        return dest
+
+    def test_cached(self):
+        path = self.copy(BOOTLOADER)
+        first = hexcache.load(path)
+        self.assertEqual(len(os.listdir(os.path.join(self.dir, "cache", "blobs"))), 1)
+
+        #the second load comes from the blob, without parsing
+        parse = hexcache.parse
+        def failParse(text):
+            raise AssertionError("parsed again")
+        hexcache.parse = failParse
+        try:
+            second = hexcache.load(path)
+        finally:
+            hexcache.parse = parse
+
+        self.assertEqual([(a, bytes(d)) for a, d in first.segments],
+                         [(a, bytes(d)) for a, d in second.segments])
+        self.assertEqual((first.mode, first.start), (second.mode, second.start))
+
+    def test_changed_file(self):
+        path = os.path.join(self.dir, "app.hex")
+        with open(path, "w") as f:
+            f.write(":0400000001020304F2\n:00000001FF\n")
+        self.assertEqual(bytes(hexcache.load(path).segments[0][1]), b'\x01\x02\x03\x04')
+
+        with open(path, "w") as f:
+            f.write(":0400000005060708E2\n:00000001FF\n")
+        os.utime(path, ns=(0, 0))
+        self.assertEqual(bytes(hexcache.load(path).segments[0][1]), b'\x05\x06\x07\x08')
+
+    def test_loaders_agree(self):
+        path = self.copy(SOFTDEVICE)
+        cached = [ihex.IHex.read_file(path), intelhex.IntelHex(path), MultiHexFile([path, BOOTLOADER], pad=0xff)]
+        cached += [ihex.IHex.read_file(path), intelhex.IntelHex(path), MultiHexFile([path, BOOTLOADER], pad=0xff)]
+
+        self.useCache("off")
+        parsed = [ihex.IHex.read_file(path), intelhex.IntelHex(path), MultiHexFile([path, BOOTLOADER], pad=0xff)]
+
+        for i in (0, 3):
+            self.assertEqual(cached[i].areas, parsed[0].areas)
+            self.assertEqual((cached[i].mode, cached[i].start), (parsed[0].mode, parsed[0].start))
+            self.assertEqual(cached[i + 1]._buf, parsed[1]._buf)
+            self.assertEqual(cached[i + 1].start_addr, parsed[1].start_addr)
+            self.assertEqual(cached[i + 2].extract(0, 0x80000), parsed[2].extract(0, 0x80000))
+
+    def test_read_areas(self):
+        #records out of order leave adjacent areas that IHex.read doesn't join
+        first = hexText({0x1000: b'\x01' * 16, 0x1020: b'\x03' * 16}).splitlines()[:-1]
+        second = hexText({0x1010: b'\x02' * 16, 0x2000: bytes(range(64))}, reverse=True).splitlines()
+        path = os.path.join(self.dir, "order.hex")
+        with open(path, "w") as f:
+            f.write("\n".join(first + second) + "\n")
+        cached = ihex.IHex.read_file(path)
+        with open(path, "r") as f:
+            parsed = ihex.IHex.read(f)
+        self.assertEqual(list(cached.areas.items()), list(parsed.areas.items()))
+        self.assertEqual(len(parsed.areas), 6)
+
+        #cached areas are views of the blob, and still take new data
+        self.assertTrue(all(isinstance(data, memoryview) for data in cached.areas.values()))
+        for h in (cached, parsed):
+            h.insert_data(0x1008, b'\xaa' * 16)
+            h.insert_data(0x2030, b'\xbb' * 32)
+        self.assertEqual(list(cached.areas.items()), list(parsed.areas.items()))
+
+    def test_prune(self):
+        root = os.path.join(self.dir, "cache")
+        blobs = os.path.join(root, "blobs")
+        first = self.copy(BOOTLOADER)
+        hexcache.load(first)
+        self.assertEqual(len(os.listdir(blobs)), 1)
+
+        #the next new file prunes the entry and blob of the deleted one
+        os.remove(first)
+        for name in os.listdir(blobs):
+            os.utime(os.path.join(blobs, name), (0, 0))
+        hexcache.load(self.copy(SOFTDEVICE))
+        self.assertEqual(len(os.listdir(os.path.join(root, "paths"))), 1)
+        self.assertEqual(len(os.listdir(blobs)), 1)
+
+        #a blob pruned for size is parsed again on the next load
+        hexcache.prune(root, maxSize=0)
+        self.assertEqual(os.listdir(blobs), [])
+        self.assertIsNotNone(hexcache.load(os.path.join(self.dir, os.path.basename(SOFTDEVICE))))
+        self.assertEqual(len(os.listdir(blobs)), 1)
+
+    def test_overlap_not_cached(self):
+        path = os.path.join(self.dir, "overlap.hex")
+        with open(path, "w") as f:
+            f.write(":0400000001020304F2\n:020002000506F1\n:00000001FF\n")
+
+        self.assertIsNone(hexcache.load(path))
+        self.assertFalse(os.path.exists(os.path.join(self.dir, "cache", "blobs")))
+        with self.assertRaises(intelhex.AddressOverlapError):
+            intelhex.IntelHex(path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import random
+import struct
+import unittest
+
+#multihexfile puts tools on the path for ihex
+import multihexfile
+import ihex
+
+def record(addr, data):
+    raw = struct.pack(">BHB", len(data), addr, 0x00) + data
+    raw += bytes(((-sum(raw)) & 0xFF,))
+    return ":" + raw.hex().upper()
+
+def readPerRecord(lines):
+    """The original IHex.read, inserting every record."""
+    h = ihex.IHex()
+    for line in lines:
+        t, a, d = h.parse_line(line)
+        h.insert_data(a, d)
+    return h
+
+class TestRead(unittest.TestCase):
+
+    def check(self, records):
+        lines = [record(addr, data) for addr, data in records]
+        expect = readPerRecord(lines).areas
+        self.assertEqual(ihex.IHex.read(lines).areas, expect)
+        return expect
+
+    def test_contiguous(self):
+        areas = self.check([(0, b'A' * 16), (16, b'B' * 16), (48, b'D' * 16), (32, b'C' * 16)])
+        self.assertEqual(areas, {0: b'A' * 16 + b'B' * 16 + b'C' * 16, 48: b'D' * 16})
+
+    def test_runs_into_area(self):
+        A, B, C, D, X = (c * 16 for c in (b'A', b'B', b'C', b'D', b'X'))
+        self.assertEqual(self.check([(32, X), (0, A), (16, B), (32, C), (48, D)]),
+                         {0: A + B, 32: C + D})
+        self.assertEqual(self.check([(16, B), (0, A), (16, C), (32, D)]),
+                         {16: C + D, 0: A})
+
+    def test_overlapping_records(self):
+        rnd = random.Random(1)
+        for i in range(300):
+            records = []
+            for j in range(rnd.randrange(1, 12)):
+                addr = rnd.randrange(0, 12) * 8
+                size = rnd.choice((0, 4, 8, 8, 8, 16))
+                records.append((addr, bytes(rnd.randrange(256) for k in range(size))))
+            self.check(records)
+
+if __name__ == '__main__':
+    unittest.main()
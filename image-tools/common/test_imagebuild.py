@@ -0,0 +1,51 @@
+import os
+import struct
+import unittest
+from unittest import mock
+
+import imagebuild
+from rigdfugen import RigError
+
+BINARIES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "programming", "binaries")
+BOOTLOADER = os.path.join(BINARIES, "rigdfu2_nrf52_s132_sdk12_rel_3.3.1.46.hex")
+FAMILY = "nrf52832-sd132v3.x.0"
+
+#keep the hex files loaded here out of the user's hex cache
+hexCache = mock.patch.dict(os.environ, {"RIGADO_HEX_CACHE": "off"})
+
+def setUpModule():
+    hexCache.start()
+
+def tearDownModule():
+    hexCache.stop()
+
+class TestImageBuilder(unittest.TestCase):
+
+    def test_build(self):
+        builder = imagebuild.ImageBuilder()
+        image = builder.build([BOOTLOADER], FAMILY)
+
+        sd, bl, app = struct.unpack('<3I', image[:12])
+        self.assertEqual((sd, app), (0, 0))
+        self.assertEqual(len(image), 12 + 32 + bl)
+        self.assertEqual(image[12:44], bytes(32))
+
+    def test_cached(self):
+        builder = imagebuild.ImageBuilder()
+        first = builder.build([BOOTLOADER], FAMILY)
+        self.assertIs(builder.build([BOOTLOADER], FAMILY + ".cfg"), first)
+        self.assertEqual(builder.builds, 1)
+
+        builder.build([BOOTLOADER], "nrf52832-sd132v2.0.1")
+        builder.build([BOOTLOADER], FAMILY, bl=True)
+        self.assertEqual(builder.builds, 3)
+
+    def test_errors(self):
+        builder = imagebuild.ImageBuilder()
+        with self.assertRaises(RigError):
+            builder.build([BOOTLOADER], "no-such-family")
+        with self.assertRaises(RigError):
+            builder.build([BOOTLOADER + ".missing"], FAMILY)
+
+if __name__ == '__main__':
+    unittest.main()
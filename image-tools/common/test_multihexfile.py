@@ -0,0 +1,129 @@
+import os
+import random
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+from multihexfile import MultiHexFile
+from imageutils import RigError
+
+#keep the hex files loaded here out of the user's hex cache
+hexCache = mock.patch.dict(os.environ, {"RIGADO_HEX_CACHE": "off"})
+
+def setUpModule():
+    hexCache.start()
+
+def tearDownModule():
+    hexCache.stop()
+
+def hexText(areas, row=16, reverse=False):
+    """Intel hex text holding {address: data}, optionally with the records backwards."""
+    lines = []
+    def record(rtype, addr, data):
+        raw = struct.pack(">BHB", len(data), addr, rtype) + data
+        raw += bytes(((-sum(raw)) & 0xFF,))
+        lines.append(":" + raw.hex().upper())
+
+    for start, data in sorted(areas.items()):
+        for i in range(0, len(data), row):
+            addr = start + i
+            record(0x04, 0, struct.pack(">H", addr >> 16))
+            record(0x00, addr & 0xFFFF, data[i:i + row])
+    if reverse:
+        #keep each extended address record in front of its data record
+        pairs = [lines[i:i + 2] for i in range(0, len(lines), 2)]
+        lines = [line for pair in reversed(pairs) for line in pair]
+    record(0x01, 0, b'')
+    return "\n".join(lines) + "\n"
+
+def reference(areas, minaddr, maxaddr, pad=0xff):
+    flat = bytearray([pad]) * (maxaddr - minaddr)
+    for start, data in areas.items():
+        for i, b in enumerate(data):
+            if minaddr <= start + i < maxaddr:
+                flat[start + i - minaddr] = b
+    return bytes(flat)
+
+class TestMultiHexFile(unittest.TestCase):
+
+    def write(self, areas, reverse=False):
+        fd, path = tempfile.mkstemp(suffix=".hex")
+        with os.fdopen(fd, "w") as f:
+            f.write(hexText(areas, reverse=reverse))
+        self.addCleanup(os.remove, path)
+        return path
+
+    def areas(self, seed, count=40):
+        rnd = random.Random(seed)
+        areas = {}
+        addr = 0x1000
+        for i in range(count):
+            addr += rnd.choice((0, 0, 4, 16, 100, 0x1000))
+            size = rnd.randrange(1, 300)
+            areas[addr] = bytes(rnd.randrange(256) for j in range(size))
+            addr += size
+        return areas
+
+    def test_queries(self):
+        areas = self.areas(1)
+        mhf = MultiHexFile([self.write(areas)], pad=0xff)
+        top = max(start + len(data) for start, data in areas.items())
+        rnd = random.Random(2)
+
+        for i in range(200):
+            lo = rnd.randrange(0, top + 100)
+            hi = lo + rnd.randrange(0, 3000)
+            self.assertEqual(bytes(mhf.extract(lo, hi)), reference(areas, lo, hi))
+
+            expect = reference(areas, lo, lo + 4)
+            self.assertEqual(mhf.uint32le(lo), struct.unpack("<I", expect)[0])
+
+            present = [a for a in range(lo, hi) if any(s <= a < s + len(d) for s, d in areas.items())]
+            if present:
+                self.assertEqual(mhf.extents(lo, hi, 1), (present[0], present[-1] + 1))
+            else:
+                self.assertEqual(mhf.extents(lo, hi, 1), (None, None))
+
+    def test_records_out_of_order(self):
+        areas = self.areas(3, count=10)
+        forward = MultiHexFile([self.write(areas)], pad=0xff)
+        backward = MultiHexFile([self.write(areas, reverse=True)], pad=0xff)
+        top = max(start + len(data) for start, data in areas.items())
+        self.assertEqual(forward.extract(0, top), backward.extract(0, top))
+        self.assertEqual(bytes(backward.extract(0, top)), reference(areas, 0, top))
+
+    def test_extract_fragmented(self):
+        #one byte areas every other address
+        areas = dict((0x2000 + 2 * i, bytes((i & 0x7F,))) for i in range(2000))
+        mhf = MultiHexFile([self.write(areas)], pad=0xff)
+        out = mhf.extract(0x1ff0, 0x2000 + 4010, pad=0x00)
+        self.assertIsInstance(out, bytearray)
+        self.assertEqual(bytes(out), reference(areas, 0x1ff0, 0x2000 + 4010, pad=0x00))
+        self.assertEqual(mhf.extract(0x3000, 0x2000), bytearray())
+
+    def test_merge(self):
+        first = self.write({0x1000: b'\x01' * 32, 0x3000: b'\x03' * 16})
+        second = self.write({0x1020: b'\x02' * 32, 0x3000: b'\x03' * 16})
+        mhf = MultiHexFile([first, second], pad=0xff)
+
+        #adjacent areas are coalesced, identical duplicates allowed
+        self.assertEqual(mhf.starts, [0x1000, 0x3000])
+        self.assertEqual(mhf.extract(0x1000, 0x1040), b'\x01' * 32 + b'\x02' * 32)
+
+    def test_merge_conflict(self):
+        first = self.write({0x1000: b'\x01' * 32})
+        second = self.write({0x101c: b'\x01' * 8})
+        with self.assertRaises(RigError) as cm:
+            MultiHexFile([first, second], pad=0xff)
+        self.assertIn("101c", str(cm.exception))
+        self.assertIn(first, str(cm.exception))
+        self.assertIn(second, str(cm.exception))
+
+    def test_extents_rounding(self):
+        mhf = MultiHexFile([self.write({0x1002: b'\x01' * 5})], pad=0xff)
+        self.assertEqual(mhf.extents(0, 0x2000), (0x1000, 0x1008))
+        self.assertEqual(mhf.extents(0x2000, 0x3000), (None, None))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import struct
+import unittest
+from unittest import mock
+
+import rigcrypto
+from rigcrypto import SignError
+
+KEY = bytes(range(16))
+
+#signimage-linux output for a 48 byte image of 00..2f with KEY
+SIGNED = bytes.fromhex(
+    '300000000000000000000000'
+    'c435aa5e19098a186c5d593052f2c974'
+    'ff3af0973609a5d1b3dca32156fc7fe2'
+    'e4d6afda4e16db05fb2d18156d711036'
+    '1b3eacf083aa67b9b4d2a69a43c1c68b'
+    '2d5c32f6f7ce68a71a6b14c59edd6ff3')
+
+def plainImage(data, lengths=None):
+    if lengths is None:
+        lengths = (len(data), 0, 0)
+    return struct.pack('<3I', *lengths) + bytes(32) + bytes(data)
+
+class TestPurePython(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(rigcrypto, '_AES', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_aes_fips197(self):
+        cipher = rigcrypto.AES128(bytes.fromhex('000102030405060708090a0b0c0d0e0f'))
+        self.assertEqual(cipher.encryptBlock(bytes.fromhex('00112233445566778899aabbccddeeff')),
+                         bytes.fromhex('69c4e0d86a7b0430d8cdb78070b4c55a'))
+
+    def test_eax_vectors(self):
+        #from the EAX paper, Bellare, Rogaway, Wagner
+        ct, tag = rigcrypto.eaxEncrypt(bytes.fromhex('233952DEE4D5ED5F9B9C6D6FF80FF478'),
+                                       bytes.fromhex('62EC67F9C3A4A407FCB2A8C49031A8B3'),
+                                       bytes.fromhex('6BFB914FD07EAE6B'), b'')
+        self.assertEqual(ct, b'')
+        self.assertEqual(tag, bytes.fromhex('E037830E8389F27B025A2D6527E79D01'))
+
+        ct, tag = rigcrypto.eaxEncrypt(bytes.fromhex('91945D3F4DCBEE0BF45EF52255F095A4'),
+                                       bytes.fromhex('BECAF043B0A23D843194BA972C66DEBD'),
+                                       bytes.fromhex('FA3BFD4806EB53FA'), bytes.fromhex('F7FB'))
+        self.assertEqual(ct + tag, bytes.fromhex('19DD5C4C9331049D0BDAB0277408F67967E5'))
+
+    def test_matches_signimage(self):
+        self.assertEqual(rigcrypto.signImage(plainImage(range(48)), KEY, SIGNED[12:28]), SIGNED)
+        self.assertEqual(rigcrypto.unsignImage(SIGNED, KEY), plainImage(range(48)))
+
+class TestSignImage(unittest.TestCase):
+
+    def test_round_trip(self):
+        plain = plainImage(range(200), (100, 60, 40))
+        signed = rigcrypto.signImage(plain, KEY)
+        self.assertEqual(signed[:12], plain[:12])
+        self.assertNotEqual(signed[44:], plain[44:])
+        self.assertEqual(rigcrypto.unsignImage(signed, KEY), plain)
+
+    def test_random_iv(self):
+        plain = plainImage(range(48))
+        self.assertNotEqual(rigcrypto.signImage(plain, KEY), rigcrypto.signImage(plain, KEY))
+
+    def test_rejects_encrypted(self):
+        with self.assertRaises(SignError):
+            rigcrypto.signImage(SIGNED, KEY)
+
+    def test_rejects_bad_lengths(self):
+        with self.assertRaises(SignError):
+            rigcrypto.signImage(plainImage(range(48))[:40], KEY)
+        with self.assertRaises(SignError):
+            rigcrypto.signImage(plainImage(range(48), (50, 0, 0)), KEY)
+        with self.assertRaises(SignError):
+            rigcrypto.signImage(plainImage(range(48), (40, 0, 0)), KEY)
+        with self.assertRaises(SignError):
+            rigcrypto.signImage(plainImage(range(48)), KEY[:8])
+
+    def test_wrong_key(self):
+        with self.assertRaises(SignError):
+            rigcrypto.unsignImage(SIGNED, bytes(16))
+
+        tampered = bytearray(SIGNED)
+        tampered[-1] ^= 1
+        with self.assertRaises(SignError):
+            rigcrypto.unsignImage(bytes(tampered), KEY)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import random
+import struct
+import unittest
+
+import rigpatch
+from rigpatch import PatchError
+
+def edited(old, seed=1):
+    rnd = random.Random(seed)
+    new = bytearray(old)
+    new[1000:1000] = bytes(rnd.randrange(256) for i in range(300))
+    for i in range(50):
+        new[rnd.randrange(len(new))] = rnd.randrange(256)
+    del new[6000:6500]
+    new[7000:7000] = b'\xa7' * 20
+    new += b'\xff' * (-len(new) % 4)
+    return bytes(new)
+
+class TestPatch(unittest.TestCase):
+
+    def test_lengths(self):
+        for n in (1, 2, 252, 253, 508, 509, 0xFFFF, 0x10000, 0x123456):
+            data = rigpatch.encodeLength(n)
+            self.assertEqual(rigpatch._readLength(data, 0), (n, len(data)))
+        with self.assertRaises(PatchError):
+            rigpatch.encodeLength(0)
+
+    def test_round_trip(self):
+        old = os.urandom(16384)
+        new = edited(old)
+        data, stats = rigpatch.diff(old, new)
+
+        self.assertEqual(rigpatch.apply(old, data), new)
+        self.assertLess(len(data), len(new) // 4)
+        self.assertEqual(stats.patchLen, len(data))
+        self.assertEqual(stats.newCrc, rigpatch.crc32(new))
+
+    def test_escapes(self):
+        old = b'\xa7' * 64
+        new = b'\xa7\xa6\xa7\xa3' * 16
+        data, stats = rigpatch.diff(old, new)
+        self.assertEqual(rigpatch.apply(old, data), new)
+
+    def test_edges(self):
+        for old, new in ((b'', b'abcd'), (b'abcd' * 10, b''), (b'x' * 100, b'x' * 100)):
+            data, stats = rigpatch.diff(old, new)
+            self.assertEqual(rigpatch.apply(old, data), new)
+
+    def test_container(self):
+        old = os.urandom(4096)
+        new = edited(old)
+        patch, stats = rigpatch.makePatch(old, new)
+
+        self.assertEqual(patch[:16], rigpatch.PATCH_KEY)
+        self.assertEqual(struct.unpack('<3I', patch[16:28]), (0, 0, len(new)))
+        self.assertEqual(patch[28:60], bytes(32))
+        length, crc, oldCrc = struct.unpack('<3I', patch[60:72])
+        self.assertEqual(length, len(patch) - 72)
+        self.assertEqual((crc, oldCrc), (rigpatch.crc32(new), rigpatch.crc32(old)))
+
+        with self.assertRaises(PatchError):
+            rigpatch.makePatch(old, new + b'\x00')
+
+    def test_check(self):
+        old = os.urandom(4096)
+        new = edited(old)
+        patch, stats = rigpatch.makePatch(old, new)
+
+        self.assertEqual(rigpatch.checkPatch(old, patch), new)
+        self.assertEqual(rigpatch.parsePatch(patch).startPkt, (0, 0, len(new)))
+
+        with self.assertRaises(PatchError):
+            rigpatch.checkPatch(new, patch)
+        with self.assertRaises(PatchError):
+            rigpatch.checkPatch(old, patch[:-1])
+        with self.assertRaises(PatchError):
+            rigpatch.checkPatch(old, bytes(16) + patch[16:])
+
+        #a good stream with the wrong new crc
+        bad = bytearray(patch)
+        bad[64] ^= 1
+        with self.assertRaises(PatchError):
+            rigpatch.checkPatch(old, bytes(bad))
+
+    def test_bad_stream(self):
+        with self.assertRaises(PatchError):
+            rigpatch.apply(b'abcd', b'\x00')
+        with self.assertRaises(PatchError):
+            rigpatch.apply(b'abcd', bytes((rigpatch.ESC, rigpatch.EQL, 10)))
+        with self.assertRaises(PatchError):
+            rigpatch.apply(b'abcd', bytes((rigpatch.ESC, rigpatch.BKT, 0)))
+        with self.assertRaises(PatchError):
+            rigpatch.apply(b'abcd', bytes((rigpatch.ESC, rigpatch.DEL, 253, 1)))
+
+if __name__ == '__main__':
+    unittest.main()
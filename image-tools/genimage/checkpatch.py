@@ -0,0 +1,120 @@
+#!/usr/bin/python
+
+'''
+  Tool to check RigDfu application patch files before sending them
+
+  Each patch is applied to the old application the way the bootloader
+  applies it, and checked against the CRC-32s in its patch init packet.
+  Directories are searched for .bin files and the patches are checked in
+  parallel.
+
+  @copyright (c) Rigado, LLC. All rights reserved.
+
+  Source code licensed under BMD Software License Agreement.
+  You should have received a copy with purchase of Rigado product.
+  If not, contact info@rigado.com for for a copy.
+'''
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+
+from imagebuild import ImageBuilder, RigError, CONFIG_DIR
+from genpatch import app_image, parse_addr
+import rigpatch
+
+#old application, set once in each worker process
+_old = None
+
+def _init_worker(old):
+    global _old
+    _old = old
+
+def find_patches(paths):
+    """The patch files given, with directories expanded to their .bin files."""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                found += [os.path.join(root, name) for name in sorted(files)
+                          if name.lower().endswith(".bin")]
+        else:
+            found.append(path)
+    return found
+
+def check_file(path, old=None):
+    """(path, error or None, new application length, new crc32) for one patch file."""
+    if old is None:
+        old = _old
+    try:
+        with open(path, "rb") as f:
+            new = rigpatch.checkPatch(old, f.read())
+    except (IOError, rigpatch.PatchError) as e:
+        return (path, str(e), None, None)
+    return (path, None, len(new), rigpatch.crc32(new))
+
+def check_files(old, paths, jobs=None):
+    """Check every patch in 'paths' against 'old', in parallel; results in order."""
+    if jobs == 1 or len(paths) <= 1:
+        return [check_file(path, old) for path in paths]
+    with ProcessPoolExecutor(max_workers = jobs, initializer = _init_worker,
+                             initargs = (old,)) as pool:
+        return list(pool.map(check_file, paths))
+
+if __name__ == "__main__":
+    import argparse
+
+    description = "Check application patches for RigDFU bootloader"
+    parser = argparse.ArgumentParser(description = description)
+
+    parser.add_argument("patches", metavar = "PATCH", nargs = "+",
+                        help = "Patch file(s), or directories of .bin patch files")
+    old_group = parser.add_mutually_exclusive_group(required = True)
+    old_group.add_argument("--old", metavar = "HEXFILE", nargs = "+",
+                           help = "Hex file(s) of the application on the device")
+    old_group.add_argument("--old-app", metavar = "BIN",
+                           help = "Raw application binary on the device")
+    parser.add_argument("-f", "--family", type = str,
+                        help = "Configuration file, a path or a name in %s (with --old)" % CONFIG_DIR)
+    parser.add_argument("--application-addr", "-A", metavar = "LOW-HIGH",
+                        help = "Application location, guessed if unspecified")
+    parser.add_argument("--jobs", "-j", type = int,
+                        help = "Patches checked at once [number of CPUs]")
+    parser.add_argument("--quiet", "-q", action = "store_true",
+                        help = "Only print failures")
+
+    args = parser.parse_args()
+    if args.old and not args.family:
+        parser.error("--old needs --family")
+
+    try:
+        if args.old:
+            builder = ImageBuilder(verbose = False)
+            old = app_image(builder, args.old, args.family, parse_addr(args.application_addr))
+        else:
+            with open(args.old_app, "rb") as f:
+                old = f.read()
+    except (IOError, RigError) as e:
+        sys.stderr.write("Error: %s\n" % str(e))
+        raise SystemExit(1)
+
+    paths = find_patches(args.patches)
+    if not paths:
+        sys.stderr.write("Error: no patch files found\n")
+        raise SystemExit(1)
+
+    failed = 0
+    for path, error, length, crc in check_files(old, paths, args.jobs):
+        if error:
+            failed += 1
+            print("FAIL %s: %s" % (path, error))
+        elif not args.quiet:
+            print("  OK %s: %d bytes, crc32 %08x" % (path, length, crc))
+
+    if not args.quiet:
+        sys.stderr.write("%d of %d patches OK for old application crc32 %08x\n"
+                         % (len(paths) - failed, len(paths), rigpatch.crc32(old)))
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+
+'''
+  Tool to build RigDfu application patch files from two builds' hex files
+
+  @copyright (c) Rigado, LLC. All rights reserved.
+
+  Source code licensed under BMD Software License Agreement.
+  You should have received a copy with purchase of Rigado product.
+  If not, contact info@rigado.com for for a copy.
+'''
+
+import os
+import struct
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+
+from imagebuild import ImageBuilder, RigError, CONFIG_DIR
+import rigpatch
+
+def parse_addr(s):
+    if not s:
+        return None
+    (l, h) = s.split('-')
+    return (int(l, 0), int(h, 0))
+
+def app_image(builder, hexfiles, family, app_addr):
+    """Application bytes genimage would put in an image for these hex files."""
+    image = builder.build(hexfiles, family, app=True, app_addr=app_addr)
+    sd, bl, app = struct.unpack('<3I', image[:12])
+    return image[44:44 + app]
+
+def print_stats(stats, out=sys.stderr):
+    out.write("%12s: %d bytes, crc32 %08x\n" % ("Old app", stats.oldLen, stats.oldCrc))
+    out.write("%12s: %d bytes, crc32 %08x\n" % ("New app", stats.newLen, stats.newCrc))
+    out.write("%12s: %d bytes (%.1f%% of the new app) in %d operations\n"
+              % ("Patch", stats.patchLen, 100.0 * stats.patchLen / max(stats.newLen, 1), stats.ops))
+    out.write("%12s: %d equal, %d modified, %d inserted, %d deleted, %d backtracked\n"
+              % ("Bytes", stats.equal, stats.modified, stats.inserted, stats.deleted, stats.backtracked))
+
+if __name__ == "__main__":
+    import argparse
+
+    description = "Generate application patches for RigDFU bootloader"
+    parser = argparse.ArgumentParser(description = description)
+
+    parser.add_argument("--old", metavar = "HEXFILE", nargs = "+", required = True,
+                        help = "Hex file(s) of the application on the device")
+    parser.add_argument("--new", metavar = "HEXFILE", nargs = "+", required = True,
+                        help = "Hex file(s) of the application to update to")
+    parser.add_argument("--output", "-o", metavar = "BIN", required = True,
+                        help = "Output patch file")
+    parser.add_argument("--quiet", "-q", action = "store_true",
+                        help = "Print less output")
+    parser.add_argument("-f", "--family", type = str, required = True,
+                        help = "Configuration file, a path or a name in %s" % CONFIG_DIR)
+    parser.add_argument("--application-addr", "-A", metavar = "LOW-HIGH",
+                        help = "Application location, guessed if unspecified")
+
+    args = parser.parse_args()
+
+    try:
+        builder = ImageBuilder(verbose = not args.quiet)
+        app_addr = parse_addr(args.application_addr)
+        old = app_image(builder, args.old, args.family, app_addr)
+        new = app_image(builder, args.new, args.family, app_addr)
+
+        patch, stats = rigpatch.makePatch(old, new)
+        with open(args.output, "wb") as f:
+            f.write(patch)
+
+        if not args.quiet:
+            print_stats(stats)
+            sys.stderr.write("Wrote %d bytes to %s\n" % (len(patch), args.output))
+    except (RigError, rigpatch.PatchError) as e:
+        sys.stderr.write("Error: %s\n" % str(e))
+        raise SystemExit(1)
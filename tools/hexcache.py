@@ -0,0 +1,327 @@
+'''
+  Persistent cache of parsed Intel hex files
+
+  The SoftDevice and bootloader hex files are large and never change, yet
+  genimage.py, program.py and hex2bin.py parse them on every run.  load()
+  parses a hex file once, saves the result as a compact blob and maps that
+  blob on later loads instead of parsing the text again:
+
+    parsed = hexcache.load("s132_nrf52_3.1.0_softdevice.hex")
+    for addr, data in parsed.segments:
+        ...
+
+  ihex.IHex.read_file(), intelhex.IntelHex (given a file name) and so
+  MultiHexFile all load through it.
+
+  Blobs are named by the SHA-256 of the hex file's contents, so copies of
+  the same file share one.  A small entry per path records the file's path,
+  size and mtime with that hash, so an unchanged file isn't hashed again.  A
+  blob is laid out as:
+
+    char[4]     - magic, "RHXC"
+    uint32_t    - format version
+    uint32_t    - number of segments
+    uint8_t     - address mode (8, 16 or 32) as ihex tracks it
+    uint8_t     - start address record type: 0 (none), 3 or 5
+    uint16_t    - reserved
+    uint32_t[2] - start address: CS and IP (type 3), EIP (type 5)
+    uint32_t[2] - address and length of each segment
+    uint8_t[N]  - segment data, back to back
+
+  Whenever a new or changed hex file is cached, prune() drops the entries
+  of files that have since been deleted or changed, then the blobs no entry
+  uses, blobs unused for MAX_AGE and the least recently used blobs over
+  MAX_SIZE.
+
+  The cache lives in $RIGADO_HEX_CACHE, or ~/.cache/rigado/hex; setting
+  RIGADO_HEX_CACHE to "off" disables it.  Files the two hex loaders would
+  treat differently (overlapping or empty data records, repeated start
+  records) or that
+  don't parse are never cached, and load() returns None for them so the
+  caller parses the file itself.
+
+  @copyright (c) Rigado, LLC. All rights reserved.
+
+  Source code licensed under BMD Software License Agreement.
+  You should have received a copy with purchase of Rigado product.
+  If not, contact info@rigado.com for for a copy.
+'''
+
+from collections import namedtuple
+import binascii
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+
+MAGIC = b'RHXC'
+VERSION = 2
+
+#blobs unused for this many seconds are removed, as are the least
+#recently used ones once all of them together are bigger than MAX_SIZE
+MAX_AGE = 30 * 24 * 3600
+MAX_SIZE = 64 * 1024 * 1024
+
+#a blob no entry uses yet may be one another process is just adding
+_UNUSED_GRACE = 60
+
+_HEADER = struct.Struct('<4sIIBBHII')
+_SEGMENT = struct.Struct('<II')
+
+#segments are (address, memoryview) as ihex.IHex.read's areas, start is None,
+#(cs, ip) for a type 3 record or eip for a type 5 record
+ParsedHex = namedtuple('ParsedHex', 'segments mode start')
+
+def cacheDir():
+    """Directory blobs are kept in, or None if the cache is disabled."""
+    path = os.environ.get("RIGADO_HEX_CACHE")
+    if path == "off":
+        return None
+    if path:
+        return path
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "rigado", "hex")
+
+def parse(text):
+    """Parse Intel hex text into a ParsedHex.
+
+    Segments come out as the areas ihex.IHex.read builds from the same
+    records, in the same order: a record extends the segment ending where
+    it starts, or else starts a new one.  Raises ValueError for malformed
+    records, empty or overlapping data records or more than one start
+    address record."""
+    segbase = 0
+    mode = 8
+    start = None
+    segments = {}
+
+    #start of the segment ending at each address
+    ends = {}
+
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line[0] != ":":
+            raise ValueError("invalid line start character %r" % line[0])
+        record = binascii.a2b_hex(line[1:])
+        if len(record) < 5 or len(record) != record[0] + 5 or sum(record) & 0xFF:
+            raise ValueError("bad record %r" % line)
+
+        rtype = record[3]
+        addr = (record[1] << 8) | record[2]
+        data = record[4:-1]
+
+        if rtype == 0x00:
+            if not data:
+                raise ValueError("empty data record %r" % line)
+            addr += segbase
+            segStart = ends.pop(addr, None)
+            if segStart is None:
+                if addr in segments:
+                    raise ValueError("data at 0x%x overlaps earlier data" % addr)
+                segStart = addr
+                segments[addr] = bytearray()
+            segments[segStart] += data
+            end = segStart + len(segments[segStart])
+            if end in ends:
+                raise ValueError("data at 0x%x overlaps earlier data" % addr)
+            ends[end] = segStart
+
+        elif rtype == 0x01:
+            break
+
+        elif rtype in (0x02, 0x04):
+            mode = 16 if rtype == 0x02 else 32
+            segbase = struct.unpack(">H", data[0:2])[0] << (4 if rtype == 0x02 else 16)
+
+        elif rtype in (0x03, 0x05):
+            if start is not None:
+                raise ValueError("more than one start address record")
+            if rtype == 0x03:
+                mode = 16
+                start = struct.unpack(">2H", data[0:4])
+            else:
+                mode = 32
+                start = struct.unpack(">I", data[0:4])[0]
+
+        else:
+            raise ValueError("invalid record type %d" % rtype)
+
+    #overlapping records leave overlapping segments
+    last = None
+    for addr in sorted(segments):
+        if last is not None and addr < last:
+            raise ValueError("data at 0x%x overlaps earlier data" % addr)
+        last = addr + len(segments[addr])
+
+    return ParsedHex([(addr, memoryview(data)) for addr, data in segments.items()], mode, start)
+
+def pack(parsed):
+    """The blob for a ParsedHex."""
+    start = parsed.start
+    if start is None:
+        startType, startWords = 0, (0, 0)
+    elif isinstance(start, tuple):
+        startType, startWords = 3, start
+    else:
+        startType, startWords = 5, (start, 0)
+
+    out = bytearray(_HEADER.pack(MAGIC, VERSION, len(parsed.segments), parsed.mode,
+                                 startType, 0, startWords[0], startWords[1]))
+    for addr, data in parsed.segments:
+        out += _SEGMENT.pack(addr, len(data))
+    for addr, data in parsed.segments:
+        out += data
+    return out
+
+def unpack(blob):
+    """ParsedHex whose segments are views of 'blob'; raises ValueError if it isn't one."""
+    blob = memoryview(blob)
+    if len(blob) < _HEADER.size:
+        raise ValueError("blob too short")
+    magic, version, count, mode, startType, reserved, word0, word1 = _HEADER.unpack_from(blob)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a hex cache blob")
+
+    segments = []
+    offset = _HEADER.size + count * _SEGMENT.size
+    for i in range(count):
+        addr, length = _SEGMENT.unpack_from(blob, _HEADER.size + i * _SEGMENT.size)
+        segments.append((addr, blob[offset:offset + length]))
+        offset += length
+    if offset != len(blob):
+        raise ValueError("blob length doesn't match its segment table")
+
+    start = {0: None, 3: (word0, word1), 5: word0}.get(startType)
+    return ParsedHex(segments, mode, start)
+
+def _write(path, data):
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def prune(root, maxAge = MAX_AGE, maxSize = MAX_SIZE):
+    """Remove stale entries and blobs from the cache in 'root'."""
+    now = time.time()
+
+    #entries whose hex file is gone or has changed
+    used = set()
+    entryDir = os.path.join(root, "paths")
+    for name in os.listdir(entryDir) if os.path.isdir(entryDir) else ():
+        entryPath = os.path.join(entryDir, name)
+        try:
+            with open(entryPath, "r") as f:
+                entry = json.load(f)
+            st = os.stat(entry["path"])
+            current = st.st_size == entry["size"] and st.st_mtime_ns == entry["mtime"]
+        except (OSError, ValueError, KeyError, TypeError):
+            current = False
+        if current:
+            used.add(entry["sha256"] + ".bin")
+        else:
+            _remove(entryPath)
+
+    blobDir = os.path.join(root, "blobs")
+    blobs = []
+    for name in os.listdir(blobDir) if os.path.isdir(blobDir) else ():
+        blobPath = os.path.join(blobDir, name)
+        try:
+            st = os.stat(blobPath)
+        except OSError:
+            continue
+        age = now - st.st_mtime
+        if (name not in used and age > _UNUSED_GRACE) or age > maxAge:
+            _remove(blobPath)
+        else:
+            blobs.append((st.st_mtime, st.st_size, blobPath))
+
+    #newest first, so whatever doesn't fit is the least recently used
+    total = 0
+    for mtime, size, blobPath in sorted(blobs, reverse = True):
+        total += size
+        if total > maxSize:
+            _remove(blobPath)
+
+def _map(path):
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+def load(path):
+    """ParsedHex for the hex file at 'path', from the cache when possible.
+
+    Returns None if the cache is disabled or the file can't be cached; the
+    caller should then parse the file itself."""
+    root = cacheDir()
+    if root is None:
+        return None
+
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+
+    #an unchanged file is known by its path, size and mtime
+    entryPath = os.path.join(root, "paths", hashlib.sha256(os.path.abspath(path).encode("utf-8")).hexdigest())
+    stamp = {"size": st.st_size, "mtime": st.st_mtime_ns}
+    try:
+        with open(entryPath, "r") as f:
+            entry = json.load(f)
+        digest = entry["sha256"] if all(entry.get(k) == v for k, v in stamp.items()) else None
+    except (OSError, ValueError, KeyError, TypeError):
+        digest = None
+
+    raw = None
+    if digest is None:
+        with open(path, "rb") as f:
+            raw = f.read()
+        digest = hashlib.sha256(raw).hexdigest()
+
+    blobPath = os.path.join(root, "blobs", digest + ".bin")
+    try:
+        parsed = unpack(_map(blobPath))
+    except (OSError, ValueError):
+        parsed = None
+    else:
+        #its mtime is when it was last used, for prune()
+        try:
+            os.utime(blobPath)
+        except OSError:
+            pass
+
+    if parsed is None:
+        if raw is None:
+            with open(path, "rb") as f:
+                raw = f.read()
+        try:
+            parsed = parse(raw.decode("ascii"))
+        except (ValueError, UnicodeDecodeError, binascii.Error, struct.error):
+            return None
+
+        try:
+            os.makedirs(os.path.dirname(blobPath), exist_ok = True)
+            _write(blobPath, pack(parsed))
+            parsed = unpack(_map(blobPath))
+        except OSError:
+            #a read-only cache still gets the parse
+            return parsed
+
+    if raw is not None:
+        try:
+            os.makedirs(os.path.dirname(entryPath), exist_ok = True)
+            stamp["sha256"] = digest
+            stamp["path"] = os.path.abspath(path)
+            _write(entryPath, json.dumps(stamp).encode("utf-8"))
+            prune(root)
+        except OSError:
+            pass
+    return parsed
@@ -2,19 +2,48 @@ import struct
 import binascii
 import sys
 
+try:
+  import hexcache
+except ImportError:
+  hexcache = None
+
 class IHex(object):
   @classmethod
   def read(cls, lines):
     ihex = cls()
 
     segbase = 0
+
+    # Records normally follow on from each other, so they're appended to an
+    # open segment that's stored when a record doesn't continue it.  A
+    # segment is only opened where insert_data would start a new area, and
+    # is closed before it reaches the next area up (seg_limit), so records
+    # running into existing areas go through insert_data one at a time.
+    seg_start = None
+    seg = bytearray()
+    seg_limit = None
+
     for line in lines:
       line = line.strip()
       if not line: continue
 
       t, a, d = ihex.parse_line(line)
       if t == 0x00:
-        ihex.insert_data(segbase + a, d)
+        addr = segbase + a
+        if (seg_start is not None and addr == seg_start + len(seg)
+            and (seg_limit is None or addr < seg_limit)):
+          seg += d
+        else:
+          if seg_start is not None:
+            ihex.areas[seg_start] = bytes(seg)
+            seg_start = None
+          if d and ihex.get_area(addr) is None:
+            seg_start = addr
+            seg = bytearray(d)
+            above = [start for start in ihex.areas if start > addr]
+            seg_limit = min(above) if above else None
+          else:
+            ihex.insert_data(addr, d)
 
       elif t == 0x01:
         break # Should we check for garbage after this?
@@ -40,10 +69,25 @@ class IHex(object):
       else:
         raise ValueError("Invalid type byte")
 
+    if seg_start is not None:
+      ihex.areas[seg_start] = bytes(seg)
+
     return ihex
 
   @classmethod
   def read_file(cls, fname):
+    # Parsed once and then loaded from the cache, when there is one.  The
+    # areas are then read-only views of the mapped cache blob, not copies;
+    # insert_data replaces an area it changes with bytes.
+    parsed = hexcache.load(fname) if hexcache else None
+    if parsed is not None:
+      ihex = cls()
+      for addr, data in parsed.segments:
+        ihex.areas[addr] = data
+      ihex.set_mode(parsed.mode)
+      ihex.set_start(parsed.start)
+      return ihex
+
     f = open(fname, "r")
     ihex = cls.read(f)
     f.close()
@@ -109,7 +153,7 @@ class IHex(object):
     else:
       data = self.areas[area]
       # istart - iend + len(idata) + len(data)
-      self.areas[area] = data[:istart-area] + idata + data[iend-area:]
+      self.areas[area] = b''.join((data[:istart-area], idata, data[iend-area:]))
 
   def calc_checksum(self, bytes):
     if sys.version_info < (3,):
@@ -0,0 +1,76 @@
+#!/usr/bin/python
+
+"""Benchmark IHex.read against the original record by record loader.
+
+Each bundled SoftDevice hex file (or the files given on the command line)
+is loaded several times with both loaders and the median load time is
+reported.  The loaded areas are checked to be the same.
+"""
+
+import gc
+import glob
+import os
+import struct
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import ihex
+
+BINARIES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "programming", "binaries")
+
+def readPerRecord(lines):
+    """The original IHex.read, inserting every record, kept for comparison."""
+    h = ihex.IHex()
+    segbase = 0
+    for line in lines:
+        line = line.strip()
+        if not line: continue
+
+        t, a, d = h.parse_line(line)
+        if t == 0x00:
+            h.insert_data(segbase + a, d)
+        elif t == 0x01:
+            break
+        elif t == 0x02:
+            segbase = struct.unpack(">H", d[0:2])[0] << 4
+        elif t == 0x04:
+            segbase = struct.unpack(">H", d[0:2])[0] << 16
+    return h
+
+def median(values):
+    values.sort()
+    return values[int(len(values) / 2)]
+
+def runTest(func, lines, n=5):
+    times = []
+    for i in range(n):
+        gc.disable()
+        try:
+            begin = time.perf_counter()
+            func(lines)
+            end = time.perf_counter()
+        finally:
+            gc.enable()
+        times.append(end - begin)
+    return median(times)
+
+def main():
+    paths = sys.argv[1:] or sorted(glob.glob(os.path.join(BINARIES, "s132_*.hex")))
+    print("{:40} {:>7} {:>6} {:>12} {:>12} {:>8}".format("file", "records", "areas", "per record", "IHex.read", "speedup"))
+    for path in paths:
+        with open(path, "r") as f:
+            lines = f.readlines()
+
+        if readPerRecord(lines).areas != ihex.IHex.read(lines).areas:
+            raise SystemExit("loaders disagree on " + path)
+
+        old = runTest(readPerRecord, lines)
+        new = runTest(ihex.IHex.read, lines)
+        print("{:40} {:7} {:6} {:10.1f}ms {:10.1f}ms {:7.1f}x".format(
+            os.path.basename(path), len(lines), len(ihex.IHex.read(lines).areas),
+            old * 1000, new * 1000, old / new))
+
+if __name__ == "__main__":
+    main()
@@ -47,6 +47,11 @@ from bisect import bisect_right
 import os
 import sys
 
+try:
+    import hexcache
+except ImportError:
+    hexcache = None
+
 from intelhex.compat import (
     IntTypes,
     StrType,
@@ -198,6 +203,9 @@ class IntelHex(object):
 
         @param  fobj        file name or file-like object
         """
+        if getattr(fobj, "read", None) is None and self._loadcached(fobj):
+            return
+
         if getattr(fobj, "read", None) is None:
             fobj = open(fobj, "r")
             fclose = fobj.close
@@ -219,6 +227,26 @@ class IntelHex(object):
             if fclose:
                 fclose()
 
+    def _loadcached(self, fname):
+        """Load a hex file from the parsed hex cache (see tools/hexcache.py).
+        Only into an empty object, so there is nothing for the file to overlap.
+
+        @return     True if loaded, False if the file has to be parsed.
+        """
+        if hexcache is None or self._buf or self.start_addr:
+            return False
+        parsed = hexcache.load(fname)
+        if parsed is None:
+            return False
+
+        for addr, data in parsed.segments:
+            self._buf.update(zip(range_g(addr, addr + len(data)), data))
+        if isinstance(parsed.start, tuple):
+            self.start_addr = {'CS': parsed.start[0], 'IP': parsed.start[1]}
+        elif parsed.start is not None:
+            self.start_addr = {'EIP': parsed.start}
+        return True
+
     def loadbin(self, fobj, offset=0):
         """Load bin file into internal buffer. Not needed if source set in
         constructor. This will overwrite addresses without warning
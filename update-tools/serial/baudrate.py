@@ -0,0 +1,46 @@
+'''
+  Baud rate candidates and the per-port cache used by '--baud auto'
+
+  @copyright (c) Rigado, LLC. All rights reserved.
+
+  Source code licensed under BMD Software License Agreement.
+  You should have received a copy with purchase of Rigado product.
+  If not, contact info@rigado.com for for a copy.
+'''
+
+import json
+import os
+
+#rate every RigDFU2 serial loader answers at
+SAFE_BAUD = 115200
+
+#faster rates to step through, slowest first
+CANDIDATE_BAUDS = (230400, 460800, 921600, 1000000)
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser("~"), ".rigdfu_baud.json")
+
+def loadCache(path):
+    """Return the {port: baud} mapping stored at 'path', or {} if there is none.
+    Entries whose rate isn't a positive integer are left out."""
+    try:
+        with open(path, "r") as f:
+            cache = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+    if not isinstance(cache, dict):
+        return {}
+    return dict((port, baud) for port, baud in cache.items()
+                if isinstance(baud, int) and not isinstance(baud, bool) and baud > 0)
+
+def saveCache(path, cache):
+    """Write 'cache' to 'path', replacing the previous file in one step."""
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "w") as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+    os.replace(tmpPath, path)
+
+def updateCache(path, port, baud):
+    cache = loadCache(path)
+    cache[port] = baud
+    saveCache(path, cache)
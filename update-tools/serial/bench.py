@@ -0,0 +1,116 @@
+#!/usr/bin/python
+
+"""Benchmark the serial frame codec against the original per-byte loop.
+
+Each test is run several times and the median time per frame is reported.
+
+'bench.py transfer [size]' instead sends a random image of 'size' bytes to
+the simulator (rigsim.py) with a few transfer settings and reports the
+throughput of each.
+"""
+
+import asyncio
+import gc
+import os
+import struct
+import sys
+import time
+
+import framing
+
+def escapePerByte(opCode, txData):
+    """The original txPacket escaping loop, kept for comparison."""
+    txBytes = bytearray()
+    txBytes.append(0xAA)
+    txBytes.append(len(txData) + 2)
+    txBytes.append(opCode)
+    for b in txData:
+        if b == 0xAA:
+            txBytes.append(0xAB)
+            txBytes.append(0xAC)
+        elif b == 0xAB:
+            txBytes.append(0xAB)
+            txBytes.append(0xAB)
+        else:
+            txBytes.append(b)
+    return txBytes
+
+def unescapePerByte(rxData):
+    """Per-byte un-escaping, as rxPacket did before the codec."""
+    out = bytearray()
+    escape = False
+    for b in rxData:
+        if escape == False and b == 0xAB:
+            escape = True
+        elif escape == True:
+            out.append(0xAB if b == 0xAB else 0xAA)
+            escape = False
+        else:
+            out.append(b)
+    return out
+
+def median(values):
+    values.sort()
+    return values[int(len(values) / 2)]
+
+def runTest(func, frames, n=5):
+    times = []
+    for i in range(n):
+        gc.disable()
+        try:
+            begin = time.perf_counter()
+            for frame in frames:
+                func(frame)
+            end = time.perf_counter()
+        finally:
+            gc.enable()
+        times.append(end - begin)
+    return median(times) / len(frames)
+
+async def timeTransfer(port, image, baud, chunk, window):
+    from rigdfu import DfuSession, Serial_Op_Code
+
+    async with DfuSession(port, baud=baud, chunk=chunk, window=window) as session:
+        await session.start(struct.pack('<3I', 0, 0, len(image)))
+        await session.init(bytes(32))
+        begin = time.perf_counter()
+        await session.transfer(Serial_Op_Code.Image_Xfer, image)
+        return time.perf_counter() - begin
+
+def benchTransfer(argv):
+    from rigsim import RigDfuSim
+
+    size = int(argv[2]) if len(argv) > 2 else 65536
+    image = os.urandom(size)
+    flashDelay = 0.002
+
+    print("{} byte image, {:.0f}ms flash write per chunk".format(size, flashDelay * 1e3))
+    for baud in (115200, 921600):
+        for chunk, window in (("192", 1), ("192", 4), ("auto", 1), ("auto", 4)):
+            with RigDfuSim(flashDelay=flashDelay) as sim:
+                seconds = asyncio.run(timeTransfer(sim.port, image, baud, chunk, window))
+            print("{:7} baud  chunk {:4}  window {}  {:8.1f} KB/s".format(
+                baud, chunk, window, size / seconds / 1024))
+
+def main(argv):
+    if len(argv) > 1 and argv[1] == "transfer":
+        benchTransfer(argv)
+        return
+
+    count = int(argv[1]) if len(argv) > 1 else 2000
+    chunks = [os.urandom(192) for i in range(count)]
+    escaped = [framing.escape(c) for c in chunks]
+
+    tests = [
+        ("escape, per-byte",   lambda c: escapePerByte(3, c), chunks),
+        ("escape, codec",      lambda c: framing.encodeFrame(3, c), chunks),
+        ("unescape, per-byte", unescapePerByte, escaped),
+        ("unescape, codec",    framing.unescape, escaped),
+    ]
+
+    print("{} random 192-byte chunks".format(count))
+    for name, func, frames in tests:
+        print("{:20} {:8.2f} us/frame".format(name, runTest(func, frames) * 1e6))
+
+if __name__ == '__main__':
+    main(sys.argv)
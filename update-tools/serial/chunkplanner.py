@@ -0,0 +1,108 @@
+'''
+  Chunk sizing for RigDFU2 image and patch transfers
+
+  @copyright (c) Rigado, LLC. All rights reserved.
+
+  Source code licensed under BMD Software License Agreement.
+  You should have received a copy with purchase of Rigado product.
+  If not, contact info@rigado.com for for a copy.
+'''
+
+import framing
+
+def frameLength(chunk):
+    """Bytes on the wire for a transfer frame carrying 'chunk'."""
+    #start byte + length (escaped if it happens to be 0xAA/0xAB) + opcode
+    length = len(chunk) + 2
+    header = 4 if length in (framing.START_BYTE, framing.ESCAPE_BYTE) else 3
+    return header + framing.escapedLength(chunk)
+
+class ChunkPlanner(object):
+    """Decide how many bytes go into each transfer frame.
+
+    maxPayload bounds the un-escaped chunk; maxFrame, if set, bounds the
+    escaped frame on the wire.  Sizes are kept to multiples of 'align'
+    except for the final chunk of an image; maxFrame must leave room for
+    'align' bytes that all need escaping."""
+
+    #escaped frame limits to step through when the device reports Data_Sz_Err
+    FRAME_STEPS = (256, 224, 192, 160, 128, 96, 64)
+
+    def __init__(self, maxPayload, maxFrame=None, align=1, probe=False):
+        if maxFrame is not None and frameLength(bytes((framing.START_BYTE,)) * align) > maxFrame:
+            raise ValueError("a frame of {} bytes can't carry {} bytes of data".format(maxFrame, align))
+
+        self.maxPayload = maxPayload
+        self.maxFrame = maxFrame
+        self.align = align
+        self.probing = probe
+
+    @classmethod
+    def auto(cls):
+        """Planner that starts at the largest frame and probes downwards."""
+        return cls(framing.MAX_PAYLOAD - (framing.MAX_PAYLOAD % 4),
+                   maxFrame=cls.FRAME_STEPS[0], align=4, probe=True)
+
+    @classmethod
+    def fromSpec(cls, spec):
+        """Planner for a '--chunk' value: 'auto' or a fixed chunk size."""
+        if spec == "auto":
+            return cls.auto()
+
+        try:
+            chunkSz = int(spec)
+        except ValueError:
+            chunkSz = 0
+
+        if chunkSz < 1 or chunkSz > framing.MAX_PAYLOAD:
+            raise ValueError("chunk size must be 'auto' or 1-{}".format(framing.MAX_PAYLOAD))
+
+        return cls(chunkSz)
+
+    def chunkSize(self, binary, offset):
+        size = min(self.maxPayload, len(binary) - offset)
+        if self.maxFrame is None:
+            return size
+
+        #'binary' may be a memoryview, count escapes in one copy of the candidate
+        chunk = bytes(binary[offset:offset+size])
+        if frameLength(chunk) <= self.maxFrame:
+            return size
+
+        #frame length only grows with the chunk, so search for the largest fit
+        lo = 0
+        hi = size
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if frameLength(chunk[:mid]) <= self.maxFrame:
+                lo = mid
+            else:
+                hi = mid - 1
+
+        #maxFrame fits 'align' bytes however they escape, so lo >= align
+        return lo - (lo % self.align)
+
+    def accepted(self, frameSz):
+        """The device took a frame of 'frameSz' wire bytes.
+
+        Probing stops once the frame was bigger than the next smaller step,
+        as frames up to the current limit then fit; a short final chunk
+        doesn't show that."""
+        if self.maxFrame is None:
+            self.probing = False
+            return
+        smaller = [step for step in self.FRAME_STEPS if step < self.maxFrame]
+        if not smaller or frameSz > smaller[0]:
+            self.probing = False
+
+    def reduce(self, frameSz):
+        """Step below a rejected frame of 'frameSz' wire bytes.
+
+        Returns False once there is nothing smaller left to try."""
+        for step in self.FRAME_STEPS:
+            if step < frameSz:
+                self.maxFrame = step
+                payload = step - 3
+                self.maxPayload = min(self.maxPayload, payload - (payload % self.align))
+                return True
+        return False
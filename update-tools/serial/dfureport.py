@@ -0,0 +1,168 @@
+'''
+  Timing and traffic statistics for one RigDFU2 serial session
+
+  A SessionReport is kept by every DfuSession.  It records how long each
+  phase took, the round trip time of every transfer chunk (as a histogram),
+  retries and the bytes sent on the wire against the payload they carried.
+  asDict() gives a JSON-ready summary, writeReports() saves a list of them.
+
+  @copyright (c) Rigado, LLC. All rights reserved.
+
+  Source code licensed under BMD Software License Agreement.
+  You should have received a copy with purchase of Rigado product.
+  If not, contact info@rigado.com for for a copy.
+'''
+
+from contextlib import contextmanager
+import json
+import os
+import time
+
+#upper bounds of the chunk round trip histogram buckets, in ms
+RTT_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+def percentile(values, pct):
+    """Nearest-rank percentile of sorted 'values'."""
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, int(round(pct / 100.0 * len(values))) - 1))
+    return values[index]
+
+class SessionReport(object):
+
+    def __init__(self, portId):
+        self.portId = portId
+        self.started = time.time()
+        self.finished = None
+        self.error = None
+        self.settings = {}
+        self.version = None
+        self.baud = None
+
+        #images not sent because the device already ran their version
+        self.skipped = 0
+
+        #(name, seconds) in the order they ran, a phase may repeat
+        self.phases = []
+
+        self.frames = 0
+        self.wireBytes = 0
+        self.payloadBytes = 0
+
+        self.chunks = 0
+        self.chunkWireBytes = 0
+        self.chunkPayloadBytes = 0
+        self.retries = 0
+        self.rtts = []
+
+        #windowed transfers that failed and were started again one chunk at a time
+        self.restarts = 0
+
+        #times the device's patch input was full, and the time spent waiting
+        self.inputFull = 0
+        self.pausedSeconds = 0.0
+
+    @contextmanager
+    def phase(self, name):
+        """Time the body of the 'with' block as phase 'name'."""
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - begin))
+
+    def sent(self, wireSz, payloadSz):
+        self.frames += 1
+        self.wireBytes += wireSz
+        self.payloadBytes += payloadSz
+
+    def chunkSent(self, wireSz, payloadSz):
+        self.chunks += 1
+        self.chunkWireBytes += wireSz
+        self.chunkPayloadBytes += payloadSz
+
+    def chunkAnswered(self, rtt):
+        self.rtts.append(rtt)
+
+    def retried(self):
+        self.retries += 1
+
+    def paused(self, seconds):
+        self.inputFull += 1
+        self.pausedSeconds += seconds
+
+    def finish(self, error=None):
+        self.finished = time.time()
+        if error is not None:
+            self.error = str(error)
+        return self
+
+    def histogram(self):
+        counts = [0] * (len(RTT_BUCKETS_MS) + 1)
+        for rtt in self.rtts:
+            ms = rtt * 1000.0
+            for i, bound in enumerate(RTT_BUCKETS_MS):
+                if ms <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+
+        labels = ["<={}ms".format(b) for b in RTT_BUCKETS_MS] + [">{}ms".format(RTT_BUCKETS_MS[-1])]
+        return dict(zip(labels, counts))
+
+    def asDict(self):
+        phases = {}
+        for name, seconds in self.phases:
+            phases[name] = phases.get(name, 0.0) + seconds
+
+        rtts = sorted(self.rtts)
+        transferTime = phases.get("transfer")
+        rttMs = lambda v: None if v is None else round(v * 1000.0, 3)
+
+        return {
+            "port": self.portId,
+            "version": self.version,
+            "baud": self.baud,
+            "settings": self.settings,
+            "ok": self.error is None,
+            "skipped": self.skipped,
+            "error": self.error,
+            "started": self.started,
+            "seconds": (self.finished or time.time()) - self.started,
+            "phases": [{"name": name, "seconds": seconds} for name, seconds in self.phases],
+            "phaseTotals": phases,
+            "frames": {
+                "count": self.frames,
+                "wireBytes": self.wireBytes,
+                "payloadBytes": self.payloadBytes,
+            },
+            "transfer": {
+                "chunks": self.chunks,
+                "retries": self.retries,
+                "restarts": self.restarts,
+                "inputFull": self.inputFull,
+                "pausedSeconds": self.pausedSeconds,
+                "wireBytes": self.chunkWireBytes,
+                "payloadBytes": self.chunkPayloadBytes,
+                "escapeOverhead": (self.chunkWireBytes / float(self.chunkPayloadBytes) - 1.0) if self.chunkPayloadBytes else None,
+                "bytesPerSecond": (self.chunkPayloadBytes / transferTime) if transferTime else None,
+            },
+            "chunkRtt": {
+                "count": len(rtts),
+                "minMs": rttMs(rtts[0] if rtts else None),
+                "meanMs": rttMs(sum(rtts) / len(rtts) if rtts else None),
+                "p50Ms": rttMs(percentile(rtts, 50)),
+                "p95Ms": rttMs(percentile(rtts, 95)),
+                "maxMs": rttMs(rtts[-1] if rtts else None),
+                "histogram": self.histogram(),
+            },
+        }
+
+def writeReports(path, reports):
+    """Save the reports as a JSON list, written to a temp file and moved into place."""
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "w") as f:
+        json.dump([r.asDict() for r in reports], f, indent=2)
+        f.write("\n")
+    os.replace(tmpPath, path)
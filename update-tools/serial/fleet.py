@@ -0,0 +1,308 @@
+#!/usr/bin/python
+
+'''
+  Update or configure many RigDFU2 devices over serial at once
+
+  @copyright (c) Rigado, LLC. All rights reserved.
+
+  Source code licensed under BMD Software License Agreement.
+  You should have received a copy with purchase of Rigado product.
+  If not, contact info@rigado.com for for a copy.
+'''
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import asyncio
+import binascii
+import csv
+import glob
+import sys
+import time
+
+import dfu
+import dfureport
+from rigdfu import DfuError
+
+#one device to update: port, image file (or HexBuild) and optional per-device key,
+#or to configure: port and config packet
+Job = namedtuple('Job', 'port image key config', defaults=(None,))
+
+#one line of a config manifest, as bytes: mac (little-endian, as sent), old and new key
+ConfigLine = namedtuple('ConfigLine', 'port mac oldkey newkey')
+JobResult = namedtuple('JobResult', 'port ok error seconds skipped')
+
+#an image generated from hex files rather than read from a .bin
+HexBuild = namedtuple('HexBuild', 'hexfiles family')
+
+def keyed(key):
+    """Whether images for 'key' are encrypted; all 0x00 and all 0xFF mean no key."""
+    return bool(key) and set(key) not in ({0x00}, {0xFF})
+
+def encryptImage(item):
+    plainImage, key = item
+    return bytes(dfu.encryptImage(plainImage, key))
+
+class ImageCache(object):
+    """Load (and encrypt, if a key is given) each image only once.
+
+    prepare() does this for every job before the transfers start, since
+    building and encrypting images in pure Python would hold up every
+    session on the event loop.  A failure is kept and raised for each port
+    needing that image."""
+
+    def __init__(self, patch):
+        self.patch = patch
+        self.images = {}
+        self.plainImages = {}
+
+    def get(self, path, key):
+        image = self.images.get((path, key))
+        if image is None:
+            try:
+                image = self.load(path, key)
+            except Exception as e:
+                image = e
+            self.images[(path, key)] = image
+        if isinstance(image, Exception):
+            raise image
+        return image
+
+    def prepare(self, jobs, workers=None):
+        """Load the images for all update jobs, encrypting them across processes."""
+        pairs = []
+        for job in jobs:
+            pair = (job.image, job.key)
+            if job.config is None and pair not in self.images and pair not in pairs:
+                pairs.append(pair)
+
+        items = []
+        for path, key in pairs:
+            if not keyed(key):
+                self.get(path, key)
+                continue
+            try:
+                items.append(((path, key), (self.plainImage(path), key)))
+            except Exception as e:
+                self.images[(path, key)] = e
+                continue
+            self.logEncrypting(path, key)
+
+        if len(items) > 1 and workers != 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(encryptImage, item) for pair, item in items]
+                results = [self._result(future.result) for future in futures]
+        else:
+            results = [self._result(encryptImage, item) for pair, item in items]
+
+        for (pair, (plainImage, key)), encrypted in zip(items, results):
+            self.images[pair] = encrypted if isinstance(encrypted, Exception) else \
+                                self._parseEncrypted(plainImage, encrypted)
+
+    @staticmethod
+    def _result(func, *args):
+        try:
+            return func(*args)
+        except Exception as e:
+            return e
+
+    def plainImage(self, path):
+        image = self.plainImages.get(path)
+        if image is None:
+            if isinstance(path, HexBuild):
+                image = dfu.buildHexImage(path.hexfiles, path.family)
+            else:
+                with open(path, "rb") as f:
+                    image = f.read()
+            self.plainImages[path] = image
+        return image
+
+    def load(self, path, key):
+        if not keyed(key):
+            if isinstance(path, HexBuild):
+                return dfu.parseImage(self.plainImage(path), self.patch, dfu.printVerbose)
+            return dfu.loadImage(path, self.patch, dfu.printVerbose)
+
+        plainImage = self.plainImage(path)
+        self.logEncrypting(path, key)
+        return self._parseEncrypted(plainImage, encryptImage((plainImage, key)))
+
+    def logEncrypting(self, path, key):
+        name = " ".join(path.hexfiles) if isinstance(path, HexBuild) else path
+        dfu.printVerbose(1, "encrypting {} for key {}".format(name, dfu.prettyHexString(key, sep='')))
+
+    def _parseEncrypted(self, plainImage, encrypted):
+        image = dfu.parseImage(encrypted, self.patch, dfu.printVerbose)
+        #the version can only be read from the plain image
+        return image._replace(info=dfu.parseImage(plainImage, self.patch).info)
+
+def expandPorts(patterns):
+    ports = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        #not a pattern (e.g. COM3 on Windows), use it as given
+        ports.extend(matches if matches else [pattern])
+    return ports
+
+def manifestRows(path):
+    """CSV rows, stripped; blank lines, '#' comments and a 'port,...' header are skipped."""
+    with open(path, "r") as f:
+        for row in csv.reader(f):
+            row = [col.strip() for col in row]
+            if not row or not row[0] or row[0].startswith("#") or row[0].lower() == "port":
+                continue
+            yield row
+
+def readManifest(path):
+    """Read 'port,image[,key]' lines."""
+    jobs = []
+    for row in manifestRows(path):
+        if len(row) < 2 or not row[1]:
+            dfu.errorHandler("manifest line needs at least port,image: " + ",".join(row))
+
+        key = None
+        if len(row) > 2 and row[2]:
+            key = binascii.a2b_hex(dfu.parseHexString(row[2], 16))
+        jobs.append(Job(row[0], row[1], key))
+    return jobs
+
+def readConfigManifest(path):
+    """Read 'port,mac,oldkey,newkey' lines; empty fields are sent as zeros, as dfu.py does."""
+    lines = []
+    for row in manifestRows(path):
+        row += [""] * (4 - len(row))
+        #as for dfu.py, an old key alone changes nothing
+        if not (row[1] or row[3]):
+            dfu.errorHandler("config manifest line needs a mac or new key: " + ",".join(row))
+
+        mac = binascii.a2b_hex(dfu.parseHexString(row[1], 6))[::-1] if row[1] else bytes(6)
+        oldkey = binascii.a2b_hex(dfu.parseHexString(row[2], 16)) if row[2] else bytes(16)
+        newkey = binascii.a2b_hex(dfu.parseHexString(row[3], 16)) if row[3] else bytes(16)
+        lines.append(ConfigLine(row[0], mac, oldkey, newkey))
+    return lines
+
+def buildConfig(line):
+    return bytes(dfu.buildConfigPacket(line.mac, line.oldkey, line.newkey))
+
+def configJobs(lines, workers=None):
+    """Jobs pushing each line's config packet, encrypted up front across processes."""
+    if len(lines) > 1 and workers != 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            packets = list(pool.map(buildConfig, lines, chunksize=16))
+    else:
+        packets = [buildConfig(line) for line in lines]
+    return [Job(line.port, None, None, packet) for line, packet in zip(lines, packets)]
+
+async def runJob(job, options, images, slots, reports):
+    async with slots:
+        log = dfu.portLogger(job.port)
+        start = time.time()
+        error = None
+        sent = 0
+        try:
+            if job.config is not None:
+                await dfu.runDevice(job.port, options, configPkt=job.config, log=log, reports=reports)
+            else:
+                sent = await dfu.updateDevice(job.port, options, images.get(job.image, job.key), log, reports)
+        except DfuError as e:
+            error = str(e)
+        except Exception as e:
+            #anything else fails this port, not the whole run
+            error = "{}: {}".format(type(e).__name__, e)
+        if error is not None:
+            log(0, "Error: " + error)
+
+        skipped = error is None and job.config is None and sent == 0
+        result = JobResult(job.port, error is None, error, time.time() - start, skipped)
+        log(0, "{} in {:.1f}s".format(resultName(result), result.seconds))
+        return result
+
+async def runJobs(jobs, options, images, maxJobs, reports=None):
+    slots = asyncio.Semaphore(maxJobs)
+    return await asyncio.gather(*(runJob(job, options, images, slots, reports) for job in jobs))
+
+def resultName(result):
+    if not result.ok:
+        return "FAIL"
+    return "SKIP" if result.skipped else "PASS"
+
+def printSummary(results, seconds, action="updated"):
+    print("\nSummary:")
+    for r in results:
+        line = "  {}  {:24} {:7.1f}s".format(resultName(r), r.port, r.seconds)
+        if r.error:
+            line += "  " + r.error
+        print(line)
+
+    passed = sum(1 for r in results if r.ok and not r.skipped)
+    skipped = sum(1 for r in results if r.skipped)
+    line = "{}/{} devices {} in {:.1f}s".format(passed, len(results), action, seconds)
+    if skipped:
+        line += ", {} already current".format(skipped)
+    print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="RigDFU2 Serial Fleet Updater")
+    parser.add_argument("-s",   "--serial", type=str, nargs="+", help="serial ports or glob patterns (e.g. /dev/ttyUSB*)")
+    parser.add_argument("-i",   "--infile", type=str, help="packed data binary file to upload to every port")
+    parser.add_argument("--hexfile",        type=str, nargs="+", help="hex file(s) to generate the image for every port from, instead of -i")
+    parser.add_argument("-f",   "--family", type=str, help="genimage config for --hexfile, a path or a name in image-tools/genimage/config")
+    parser.add_argument("-m",   "--manifest", type=str, help="CSV of port,image[,key] lines")
+    parser.add_argument("--configs",        type=str, help="CSV of port,mac,oldkey,newkey lines to configure instead of updating")
+    parser.add_argument("-p",   "--patch", action="store_true", help="set when sending patch files")
+    parser.add_argument("-j",   "--jobs", type=int, help="ports to update at the same time [8]", default=8)
+    dfu.addPortArguments(parser)
+    parser.add_argument("-v",   "--verbose", action="store_true", help="enable verbose level 1")
+    args = parser.parse_args()
+
+    dfu.checkPortOptions(args)
+    dfu.setVerbose(1 if args.verbose else 0)
+
+    if args.jobs < 1:
+        dfu.errorHandler("--jobs/-j must be at least 1")
+
+    jobs = []
+    if args.configs:
+        if args.manifest or args.serial:
+            dfu.errorHandler("--configs can't be combined with -s/--serial or -m/--manifest")
+        lines = readConfigManifest(args.configs)
+        start = time.time()
+        try:
+            jobs.extend(configJobs(lines))
+        except DfuError as e:
+            dfu.errorHandler(str(e))
+        dfu.printVerbose(0, "encrypted {} config packets in {:.1f}s".format(len(jobs), time.time() - start))
+    if args.manifest:
+        jobs.extend(readManifest(args.manifest))
+    if args.serial:
+        if args.hexfile != None:
+            if args.infile != None:
+                dfu.errorHandler("pass only one of --infile/-i and --hexfile")
+            image = HexBuild(tuple(args.hexfile), args.family)
+        elif args.infile != None:
+            image = args.infile
+        else:
+            dfu.errorHandler("--infile/-i or --hexfile must be specified with -s/--serial")
+        jobs.extend(Job(port, image, None) for port in expandPorts(args.serial))
+
+    if not jobs:
+        dfu.errorHandler("no ports specified, pass -s/--serial, -m/--manifest or --configs")
+
+    images = ImageCache(args.patch)
+    start = time.time()
+    images.prepare(jobs)
+    dfu.printVerbose(1, "prepared {} images in {:.1f}s".format(len(images.images), time.time() - start))
+    reports = []
+    try:
+        results = asyncio.run(runJobs(jobs, args, images, args.jobs, reports))
+        printSummary(results, time.time() - start, "configured" if args.configs else "updated")
+    finally:
+        if args.report and reports:
+            dfureport.writeReports(args.report, reports)
+            dfu.printVerbose(1, "report written to " + args.report)
+
+    if not all(r.ok for r in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
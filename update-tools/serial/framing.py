@@ -0,0 +1,152 @@
+'''
+  RigDFU2 serial frame codec
+
+  Frames on the wire are laid out as:
+
+    0xAA | length | opcode | payload...
+
+  where length counts itself, the opcode and the payload.  The length and
+  payload bytes are escaped so that 0xAA only ever appears as a start byte:
+
+    0xAA -> 0xAB 0xAC
+    0xAB -> 0xAB 0xAB
+
+  @copyright (c) Rigado, LLC. All rights reserved.
+
+  Source code licensed under BMD Software License Agreement.
+  You should have received a copy with purchase of Rigado product.
+  If not, contact info@rigado.com for for a copy.
+'''
+
+import re
+
+START_BYTE = 0xAA
+ESCAPE_BYTE = 0xAB
+
+#largest payload the length byte can describe (length includes itself + opcode)
+MAX_PAYLOAD = 253
+
+_unescapeTable = {
+    b'\xab': b'\xab',
+    b'\xac': b'\xaa',
+}
+
+#an escape byte followed by its (possibly missing) partner
+_escapeSeq = re.compile(b'\xab(.?)', re.DOTALL)
+
+class FrameError(Exception):
+    pass
+
+def _unescapeMatch(match):
+    seq = match.group(1)
+    try:
+        return _unescapeTable[seq]
+    except KeyError:
+        if len(seq) == 0:
+            raise FrameError("truncated escape sequence")
+        raise FrameError("illegal escaped char: " + hex(seq[0]))
+
+def escape(data):
+    """Return 'data' with 0xAA/0xAB escaped for transmission."""
+    #0xAB first, otherwise the escapes produced for 0xAA would be escaped again
+    return bytes(data).replace(b'\xab', b'\xab\xab').replace(b'\xaa', b'\xab\xac')
+
+def unescape(data):
+    """Decode a complete escaped buffer in one pass."""
+    data = bytes(data)
+    if ESCAPE_BYTE not in data:
+        return data
+    return _escapeSeq.sub(_unescapeMatch, data)
+
+def escapedLength(data):
+    """Number of bytes 'data' occupies on the wire once escaped."""
+    return len(data) + data.count(b'\xaa') + data.count(b'\xab')
+
+def encodeFrame(opCode, payload=None):
+    """Build a complete, escaped frame for 'opCode' carrying 'payload'."""
+    if payload is None:
+        payload = b''
+
+    if len(payload) > MAX_PAYLOAD:
+        raise FrameError("illegal data length {} > {} bytes".format(len(payload), MAX_PAYLOAD))
+
+    header = bytes((START_BYTE,)) + escape(bytes((len(payload) + 2,))) + bytes((opCode,))
+    return header + escape(payload)
+
+class FrameDecoder(object):
+    """Incrementally un-escape a byte stream that may arrive in pieces.
+
+    An escape byte at the very end of a piece is held back until its
+    partner arrives with the next call to feed()."""
+
+    def __init__(self):
+        self.pending = b''
+
+    def feed(self, data):
+        data = self.pending + bytes(data)
+        self.pending = b''
+
+        #a trailing run of escape bytes pairs up from its start, so an odd
+        #run ends with an escape whose partner hasn't arrived yet
+        run = len(data) - len(data.rstrip(b'\xab'))
+        if run % 2:
+            self.pending = data[-1:]
+            data = data[:-1]
+
+        return unescape(data)
+
+    def needsMore(self):
+        """True if an escape sequence is only partially received."""
+        return len(self.pending) != 0
+
+class FrameAssembler(object):
+    """Reassemble complete frames out of an arbitrarily split byte stream.
+
+    Frames are returned un-escaped and including their start byte, i.e.
+    0xAA | length | opcode | payload.  Bytes outside of a frame are counted
+    in 'discarded'; a 0xAA in the middle of a frame restarts framing since
+    it can only ever be a start byte."""
+
+    def __init__(self):
+        self.frame = None
+        self.decoder = None
+        self.discarded = 0
+
+    def feed(self, data):
+        frames = []
+        pieces = bytes(data).split(b'\xaa')
+
+        self._append(pieces[0], frames)
+        for piece in pieces[1:]:
+            if self.frame is not None:
+                self.discarded += len(self.frame)
+            self.frame = bytearray((START_BYTE,))
+            self.decoder = FrameDecoder()
+            self._append(piece, frames)
+
+        return frames
+
+    def _append(self, piece, frames):
+        if self.frame is None:
+            self.discarded += len(piece)
+            return
+
+        try:
+            self.frame += self.decoder.feed(piece)
+        except FrameError:
+            self.discarded += len(self.frame) + len(piece)
+            self.frame = None
+            return
+
+        if len(self.frame) < 2:
+            return
+
+        #length covers itself and the opcode, so anything below 2 is garbage
+        frameLen = 1 + self.frame[1]
+        if self.frame[1] < 2:
+            self.discarded += len(self.frame)
+            self.frame = None
+        elif len(self.frame) >= frameLen:
+            frames.append(bytes(self.frame[:frameLen]))
+            self.discarded += len(self.frame) - frameLen
+            self.frame = None
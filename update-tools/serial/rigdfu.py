@@ -0,0 +1,851 @@
+'''
+  asyncio engine for the RigDFU2 serial loader
+
+  A DfuSession activates one loader and then runs protocol operations as
+  coroutines, so a single event loop can drive many ports at once:
+
+    async with DfuSession("/dev/ttyUSB0") as session:
+        await session.dfu(loadImage("image.bin"))
+
+  Failures are raised as DfuError.
+
+  @copyright (c) Rigado, LLC. All rights reserved.
+
+  Source code licensed under BMD Software License Agreement.
+  You should have received a copy with purchase of Rigado product.
+  If not, contact info@rigado.com for for a copy.
+'''
+
+from collections import namedtuple, deque
+from enum import IntEnum
+from struct import unpack
+import asyncio
+import binascii
+import io
+import mmap
+import os
+import re
+import time
+
+import serial
+
+import baudrate
+import framing
+from dfureport import SessionReport
+from chunkplanner import ChunkPlanner
+
+class Serial_Op_Code(IntEnum):
+    Start            = 1
+    Init             = 2
+    Image_Xfer       = 3
+    Validate         = 4
+    Activate_N_Reset = 5
+    Reset            = 6
+    Config           = 9
+    InitPatch        = 10
+    Patch_Xfer       = 11
+    Response         = 16
+
+class Serial_Op_Status(IntEnum):
+    Success             = 1
+    Invalid_State_Err   = 2
+    Not_Supported_Err   = 3
+    Data_Sz_Err         = 4
+    CRC_Err             = 5
+    Op_Failed_Err       = 6
+    Success_Need_Addl_Data = 7
+    Patch_Input_Full    = 8
+
+#written to the port to start the serial loader
+ACTIVATE_MAGIC = bytes((0xca, 0x9d, 0xc6, 0xa4))
+
+#version banner the loader answers with, "x.x.x (xx)\r\n"
+BANNER = re.compile(br'(\d+\.\d+\.\d+ \(\d+\))\r\n')
+
+#the magic is resent after 50ms, doubling up to 0.5s, until the timeout
+ACTIVATE_RETRY_MIN = 0.05
+ACTIVATE_RETRY_MAX = 0.5
+ACTIVATE_TIMEOUT = 6.0
+
+#times a transfer chunk is resent before the update is abandoned
+CHUNK_RETRIES = 3
+
+#chunk answers worth resending for; anything else stops the transfer
+RETRY_STATUSES = (None, Serial_Op_Status.CRC_Err)
+
+#a patch chunk the device had no room for is resent after 10ms, doubling up
+#to 0.5s, until the device has had the timeout to make room for it
+#with a window, all chunks in flight are answered before any past each
+#boundary of this many bytes is sent, so a lost answer shows up there
+WINDOW_SYNC_SZ = 4096
+
+PATCH_FULL_PAUSE_MIN = 0.01
+PATCH_FULL_PAUSE_MAX = 0.5
+PATCH_FULL_TIMEOUT = 10.0
+
+class DfuError(Exception):
+    pass
+
+class WindowFailed(DfuError):
+    """A chunk failed while others were in flight; the device may have taken
+    the later ones, so the transfer can only be started again."""
+    pass
+
+def noLog(verbosity, outString):
+    pass
+
+def hexString(inBytes):
+    temp = binascii.hexlify(bytes(inBytes)).decode("utf-8").upper()
+    return ' '.join(temp[i:i+2] for i in range(0, len(temp), 2))
+
+def verifyVersion(version):
+    if not (version.find("3.2.1") == -1):
+        raise DfuError('RigDFU v3.2.1 cannot be updated as a direct bootloader update. See Errata information in Release Notes.')
+
+#packed image layout, as produced by genimage/signimage
+StartPkt        = namedtuple('StartPkt', 'sd bl app')
+InitPkt         = namedtuple('InitPkt', 'iv tag')
+PatchInitPkt    = namedtuple('PatchInitPkt', 'len crc oldcrc')
+
+#an unpacked image or patch file; info is the bootloader's FirmwareInfo, if
+#the image has a bootloader and isn't encrypted
+DfuImage        = namedtuple('DfuImage', 'patch startBin initBin patchInitBin imageBin startPkt info',
+                             defaults=(None,))
+
+#rig_firmware_info_t (src/rig_firmware_info.h), at the bootloader start + 0x1000
+FIRMWARE_INFO_OFFSET = 0x1000
+FIRMWARE_INFO_MAGIC_A = 0x465325D4
+FIRMWARE_INFO_MAGIC_B = 0x49B0784C
+
+#the struct is packed, the enums' width follows from its size field
+FIRMWARE_INFO_FIXED_SZ = 4 + 4 + 3 + 4 + 2 + 4
+_ENUM_FORMATS = {1: 'B', 2: 'H', 4: 'L'}
+
+class FirmwareInfo(namedtuple('FirmwareInfo', 'major minor rev build versionType sdSupport hwSupport protocol')):
+
+    def banner(self):
+        """The version as the loader announces it, "x.x.x (build)"."""
+        return "{}.{}.{} ({})".format(self.major, self.minor, self.rev, self.build)
+
+def parseFirmwareInfo(data):
+    """FirmwareInfo from the bytes of a rig_firmware_info_t, or None if it isn't one."""
+    if len(data) < 8:
+        return None
+    magicA, size = unpack('<LL', data[:8])
+    enumWidth, extra = divmod(size - FIRMWARE_INFO_FIXED_SZ, 3)
+    if magicA != FIRMWARE_INFO_MAGIC_A or extra or enumWidth not in _ENUM_FORMATS or len(data) < size:
+        return None
+
+    fields = unpack('<LLBBBL{0}{0}{0}HL'.format(_ENUM_FORMATS[enumWidth]), data[:size])
+    if fields[-1] != FIRMWARE_INFO_MAGIC_B:
+        return None
+    return FirmwareInfo._make(fields[2:-1])
+
+def firmwareInfo(startPkt, initBin, imageBin):
+    """Bootloader FirmwareInfo in a plain image, or None."""
+    #encrypted images can't be read, and applications carry no info
+    if not startPkt.bl or any(initBin):
+        return None
+    offset = startPkt.sd + FIRMWARE_INFO_OFFSET
+    if offset >= startPkt.sd + startPkt.bl:
+        return None
+    return parseFirmwareInfo(bytes(imageBin[offset:offset + 64]))
+
+patch_key = [0xac, 0xb3, 0x37, 0xe8, 0xd0, 0xeb, 0x40, 0x90,
+             0xa4, 0xf3, 0xbb, 0x85, 0x7a, 0x5b, 0x2a, 0xf6]
+
+patch_key_size = 16
+start_packet_size = 12
+init_packet_size = 32
+patch_init_packet_size = 12
+
+def has_patch_key(byte_array):
+    return patch_key == list(byte_array)
+
+def parseImage(bindata, patch=False, log=noLog):
+    """Unpack and sanity check a packed image or patch file.
+
+    The packets and image in the DfuImage are memoryview slices of
+    'bindata', nothing is copied."""
+    patchInitBin = None
+    patchInitPkt = None
+    bindata = memoryview(bindata)
+
+    #unpack
+    try:
+
+        #raw binary
+        if patch == True or has_patch_key(bindata[:patch_key_size]):
+
+            patch_key_start         = 0
+            start_packet_start      = patch_key_start + patch_key_size
+            init_packet_start       = start_packet_start + start_packet_size
+            patch_init_packet_start = init_packet_start + init_packet_size
+            image_bin_start         = patch_init_packet_start + patch_init_packet_size
+
+            startBin     = bindata[start_packet_start:init_packet_start]
+            initBin      = bindata[init_packet_start:patch_init_packet_start]
+            patchInitBin = bindata[patch_init_packet_start:image_bin_start]
+            imageBin     = bindata[image_bin_start:]
+
+            patch = True
+
+        else:
+            start_packet_start = 0
+            init_packet_start  = start_packet_start + start_packet_size
+            image_bin_start    = init_packet_start + init_packet_size
+
+            startBin = bindata[start_packet_start:init_packet_start]
+            initBin  = bindata[init_packet_start:image_bin_start]
+            imageBin = bindata[image_bin_start:]
+
+        #parse to struct
+        startPkt    = StartPkt._make(unpack('<LLL', startBin))
+        initPkt     = InitPkt._make((initBin[:16], initBin[16:]))
+
+        if(patch):
+            patchInitPkt = PatchInitPkt._make(unpack('<LLL', patchInitBin))
+
+    except Exception:
+        raise DfuError("Unexpected binary file format!")
+
+    log(1, "startPkt: " + hexString(startBin))
+    log(1, "cryptoIV: "  + hexString(initPkt.iv))
+    log(1, "cryptoTag: " + hexString(initPkt.tag))
+    if(patch):
+        log(1, "patchInitPkt: " + hexString(patchInitBin))
+
+    log(0,"\nImage Data:\n\tsoftdevice: {}\n\tbootloader: {}\n\tapplication: {}\n\tbinarySize: {}".format(startPkt.sd, startPkt.bl, startPkt.app, len(imageBin)))
+
+    #sanity checks
+    if(startPkt.sd == 0 and startPkt.bl == 0 and startPkt.app == 0):
+        raise DfuError("sizes are all 0, no data to send.")
+
+    if((startPkt.sd % 4) or (startPkt.bl % 4) or (startPkt.app % 4)):
+        raise DfuError("sizes must be a multiple of 4")
+
+    if (startPkt.app and (startPkt.sd or startPkt.bl)):
+        raise DfuError("application must be sent by itself")
+
+    if (patch and (startPkt.sd or startPkt.bl)):
+        raise DfuError("only application can be patched")
+
+    if(not patch):
+        if ((startPkt.sd + startPkt.bl + startPkt.app) != len(imageBin)):
+            raise DfuError("total image length {} doesn't match expected {}".format(len(imageBin), (startPkt.sd + startPkt.bl + startPkt.app)))
+
+    if(patch):
+        if (patchInitPkt.len != len(imageBin)):
+            raise DfuError("not enough patch data is present")
+
+        if (patchInitPkt.crc == 0 or patchInitPkt.oldcrc == 0):
+            raise DfuError("both crc values must be present in the patch")
+
+    info = None if patch else firmwareInfo(startPkt, initBin, imageBin)
+    if info is not None:
+        log(1, "bootloader version: " + info.banner())
+
+    return DfuImage(patch, startBin, initBin, patchInitBin, imageBin, startPkt, info)
+
+def loadImage(path, patch=False, log=noLog):
+    if(os.path.exists(path) != True):
+        raise DfuError("Invalid input file specified: " + path)
+
+    #mapped rather than read, transfer chunks are then views of the file
+    with open(path, "rb") as f:
+        try:
+            bindata = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            #empty files can't be mapped
+            bindata = f.read()
+    log(1,"\nMapped {} bytes from file: {}".format(len(bindata),path))
+
+    return parseImage(bindata, patch, log)
+
+class SerialLink(object):
+    """A non-blocking pyserial port read from the event loop.
+
+    Where the port has a file descriptor the loop watches it directly;
+    otherwise (Windows) in_waiting is polled.  Complete frames are queued
+    for readFrame(); while 'capture' is set the raw bytes are also kept
+    for readMatch()."""
+
+    POLL_INTERVAL = 0.005
+
+    def __init__(self, sp, loop):
+        self.sp = sp
+        self.loop = loop
+        self.frames = asyncio.Queue()
+        self.assembler = framing.FrameAssembler()
+        self.raw = bytearray()
+        self.capture = False
+        self.dataReady = asyncio.Event()
+        self.error = None
+        self.fd = None
+        self.poller = None
+
+        try:
+            self.fd = sp.fileno()
+            loop.add_reader(self.fd, self._onReadable)
+        except (AttributeError, NotImplementedError, io.UnsupportedOperation):
+            self.fd = None
+            self.poller = loop.create_task(self._poll())
+
+    def _onReadable(self):
+        try:
+            rxBytes = self.sp.read(self.sp.in_waiting or 1)
+        except (serial.SerialException, OSError) as e:
+            self._fail(e)
+            return
+        self._feed(rxBytes)
+
+    async def _poll(self):
+        while True:
+            try:
+                waiting = self.sp.in_waiting
+                rxBytes = self.sp.read(waiting) if waiting else b''
+            except (serial.SerialException, OSError) as e:
+                self._fail(e)
+                return
+
+            if rxBytes:
+                self._feed(rxBytes)
+            else:
+                await asyncio.sleep(self.POLL_INTERVAL)
+
+    def _fail(self, e):
+        self.error = e
+        self._stopReading()
+        #wake anyone waiting
+        self.dataReady.set()
+        self.frames.put_nowait(None)
+
+    def _feed(self, rxBytes):
+        if self.capture:
+            self.raw += rxBytes
+            self.dataReady.set()
+
+        for frame in self.assembler.feed(rxBytes):
+            self.frames.put_nowait(frame)
+
+    def _stopReading(self):
+        if self.fd is not None:
+            self.loop.remove_reader(self.fd)
+            self.fd = None
+        if self.poller is not None:
+            self.poller.cancel()
+            self.poller = None
+
+    def _checkError(self):
+        if self.error is not None:
+            raise DfuError("serial port error: " + str(self.error))
+
+    async def readMatch(self, pattern, timeout_s):
+        """Wait for 'pattern' in the captured raw bytes; returns the match or None."""
+        deadline = self.loop.time() + timeout_s
+        while True:
+            self._checkError()
+            match = pattern.search(self.raw)
+            if match:
+                return match
+
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                return None
+            self.dataReady.clear()
+            try:
+                await asyncio.wait_for(self.dataReady.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def readFrame(self, timeout_s):
+        """Return the next complete frame, or None after 'timeout_s'."""
+        self._checkError()
+        try:
+            frame = await asyncio.wait_for(self.frames.get(), timeout_s)
+        except asyncio.TimeoutError:
+            return None
+        self._checkError()
+        return frame
+
+    def discardFrames(self):
+        """Drop any frames received but not read yet."""
+        while not self.frames.empty():
+            frame = self.frames.get_nowait()
+            if frame is None:
+                #keep the error wakeup
+                self.frames.put_nowait(None)
+                return
+
+    def write(self, data):
+        self._checkError()
+        try:
+            self.sp.write(data)
+        except (serial.SerialException, OSError) as e:
+            raise DfuError("serial write failed: " + str(e))
+
+    def close(self):
+        self._stopReading()
+        self.sp.close()
+
+class DfuSession(object):
+    """One RigDFU2 serial loader, activated once on open().
+
+    The port stays open for the life of the session, so several operations
+    (e.g. config, then dfu, then a patch) can run back to back.  After an
+    image is activated the device resets; the next operation re-activates
+    the loader over the same port.
+
+    baud may be a rate or "auto" to negotiate the fastest one (see
+    baudrate.py), chunk is a fixed chunk size or "auto" to probe for the
+    largest frame the device takes, once per session (see ChunkPlanner), and
+    window the number of transfer chunks to keep in flight.  A chunk
+    that times out, gets a malformed answer or CRC_Err is resent up to
+    'retries' times.  Progress goes to log(verbosity, message) and timings
+    to self.report (see dfureport.py)."""
+
+    def __init__(self, portId, baud=baudrate.SAFE_BAUD, chunk=192, window=1,
+                 baudCache=baudrate.DEFAULT_CACHE, checkVersion=False, log=None,
+                 retries=CHUNK_RETRIES, chunkTimeout=10):
+        self.portId = portId
+        self.baud = baud
+        self.chunk = chunk
+        self.window = window
+        self.baudCache = baudCache
+        self.checkVersion = checkVersion
+        self.log = log or noLog
+        self.retries = retries
+        self.chunkTimeout = chunkTimeout
+
+        self.report = SessionReport(portId)
+        self.report.settings = {"baud": baud, "chunk": chunk, "window": window, "retries": retries}
+
+        self.link = None
+        self.version = None
+        self.activeBaud = None
+        self.active = False
+        self.timeToBootloader = None
+
+        if window < 1:
+            raise DfuError("window must be at least 1")
+        #with chunk "auto" the frame size found on the first transfer is kept
+        #for the rest of the session
+        try:
+            self.planner = ChunkPlanner.fromSpec(chunk)
+        except ValueError as e:
+            raise DfuError(str(e))
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, excType, exc, tb):
+        self.close()
+
+    async def open(self):
+        self.log(0,"\nOpen serial port: {} baud: {}".format(self.portId, self.baud))
+        if self.baud == "auto":
+            connected = await self._negotiateBaud()
+        else:
+            connected = await self._activate(self.baud)
+
+        if not connected:
+            raise DfuError("openSerial - No response from RigDFU")
+
+    def close(self):
+        if self.link is not None:
+            self.link.close()
+            self.link = None
+        self.active = False
+
+    async def _handshake(self, link, timeout_s=ACTIVATE_TIMEOUT):
+        """Send the activation magic until the loader answers with its version.
+
+        The magic is resent on a short backoff, and the handshake finishes as
+        soon as the banner arrives; time to the banner is kept in
+        self.timeToBootloader."""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + timeout_s
+        retry = ACTIVATE_RETRY_MIN
+
+        link.capture = True
+        del link.raw[:]
+        try:
+            while True:
+                link.write(ACTIVATE_MAGIC)
+
+                wait = min(retry, deadline - loop.time())
+                match = await link.readMatch(BANNER, max(wait, 0))
+                if match:
+                    version = match.group(1).decode("ascii")
+                    break
+
+                if loop.time() >= deadline:
+                    return None
+                self.log(1,"no response from RigDFU, resending activation")
+                retry = min(retry * 2, ACTIVATE_RETRY_MAX)
+        finally:
+            link.capture = False
+            del link.raw[:]
+
+        self.timeToBootloader = loop.time() - started
+        self.log(0,version)
+        self.log(0,"RigDFU2 active after {:.2f}s".format(self.timeToBootloader))
+
+        if self.checkVersion:
+            verifyVersion(version)
+        return version
+
+    async def _activate(self, baud, timeout_s=ACTIVATE_TIMEOUT):
+        try:
+            sp = serial.Serial(self.portId, baud, rtscts=False, timeout=0)
+        except (serial.SerialException, ValueError) as e:
+            raise DfuError("openSerial - RigDFU initialization error: " + str(e))
+
+        link = SerialLink(sp, asyncio.get_running_loop())
+
+        #activate bootloader
+        self.log(0,"\nActivating RigDFU2 serial loader at {} baud...".format(baud))
+        try:
+            with self.report.phase("activation"):
+                version = await self._handshake(link, timeout_s)
+        except DfuError:
+            link.close()
+            raise
+
+        if version is None:
+            link.close()
+            return False
+
+        self.link = link
+        self.version = version
+        self.activeBaud = baud
+        self.active = True
+        self.report.version = version
+        self.report.baud = baud
+        return True
+
+    async def ensureActive(self):
+        """Re-activate the loader over the open port after a reset."""
+        if self.active:
+            return
+        if self.link is None:
+            raise DfuError("session is not open")
+
+        self.log(0,"\nRe-activating RigDFU2 serial loader...")
+        with self.report.phase("activation"):
+            version = await self._handshake(self.link)
+        if version is None:
+            raise DfuError("No response from RigDFU after reset")
+
+        self.version = version
+        self.active = True
+
+    async def _negotiateBaud(self):
+        #a rate that worked last time is tried first
+        cached = baudrate.loadCache(self.baudCache).get(self.portId)
+        if cached:
+            try:
+                if await self._activate(cached, timeout_s=1.0):
+                    return True
+                self.log(0,"cached rate {} baud failed, renegotiating".format(cached))
+            except DfuError as e:
+                self.log(0,"cached rate {} baud failed ({}), renegotiating".format(cached, e))
+
+        if not await self._activate(baudrate.SAFE_BAUD):
+            return False
+
+        #step up while the loader keeps answering, the banner is the probe
+        best = baudrate.SAFE_BAUD
+        for candidate in baudrate.CANDIDATE_BAUDS:
+            self.close()
+            try:
+                connected = await self._activate(candidate, timeout_s=1.0)
+            except DfuError as e:
+                self.log(1,str(e))
+                connected = False
+
+            if not connected:
+                break
+            best = candidate
+
+        if self.link is None and not await self._activate(best):
+            return False
+
+        self.log(0,"using {} baud".format(best))
+        baudrate.updateCache(self.baudCache, self.portId, best)
+        return True
+
+    def send(self, opCode, payload=None):
+        if self.link is None:
+            raise DfuError("session is not open")
+
+        frame = framing.encodeFrame(opCode, payload)
+        self.report.sent(len(frame), len(payload) if payload else 0)
+        self.log(2,"<"+hexString(frame))
+        self.link.write(frame)
+        return len(frame)
+
+    async def receiveStatus(self, opCode, timeout_s=10):
+        """Wait for the response to 'opCode'; returns its status or None."""
+        rx = await self.link.readFrame(timeout_s)
+
+        if rx is None:
+            self.log(1,"no response for op {}".format(opCode))
+            return None
+
+        self.log(2,">"+hexString(rx))
+
+        #check the length and start byte
+        if len(rx) != 5 or rx[0] != 0xAA:
+            self.log(1,"unexpected response " + hexString(rx))
+        elif rx[1] != 4:
+            self.log(1,"unexpected response length {}/{}".format(rx[1],4))
+        elif rx[2] != Serial_Op_Code.Response:
+            self.log(1,"unexpected response opcode {}/{}".format(rx[2],Serial_Op_Code.Response))
+        elif rx[3] != opCode:
+            self.log(1,"unexpected opcode {}/{}".format(rx[3],opCode))
+        else:
+            return rx[4]
+
+        return None
+
+    async def command(self, opCode, payload=None, expOpStatus=Serial_Op_Status.Success, timeout_s=10):
+        """Send one request and raise DfuError unless it is answered with 'expOpStatus'."""
+        await self.ensureActive()
+        self.send(opCode, payload)
+        status = await self.receiveStatus(opCode, timeout_s)
+
+        if status != expOpStatus:
+            self.log(0,"Fail")
+            raise DfuError("{} failed, status {}".format(Serial_Op_Code(opCode).name, status))
+
+        self.log(1,"rxOpResponse OK - op {}, status {}".format(opCode,expOpStatus))
+        self.log(0,"Success")
+
+    async def start(self, startPkt):
+        if len(startPkt) != start_packet_size:
+            raise DfuError("invalid startPkt length {} != 12".format(len(startPkt)))
+        with self.report.phase("start"):
+            await self.command(Serial_Op_Code.Start, startPkt, timeout_s=5)
+            await asyncio.sleep(.5)
+
+    async def init(self, initPkt):
+        if len(initPkt) != init_packet_size:
+            raise DfuError("invalid initPkt length {} != 32".format(len(initPkt)))
+        with self.report.phase("init"):
+            await self.command(Serial_Op_Code.Init, initPkt, timeout_s=10)
+
+    async def initPatch(self, initPatchPkt):
+        if len(initPatchPkt) != patch_init_packet_size:
+            raise DfuError("invalid initPatchPkt length {} != 12".format(len(initPatchPkt)))
+        with self.report.phase("initPatch"):
+            await self.command(Serial_Op_Code.InitPatch, initPatchPkt, timeout_s=5)
+
+    async def validate(self):
+        with self.report.phase("validate"):
+            await self.command(Serial_Op_Code.Validate, timeout_s=5)
+
+    async def activateAndReset(self):
+        await self.command(Serial_Op_Code.Activate_N_Reset, timeout_s=5)
+        #the device resets into the new image and leaves the loader
+        self.active = False
+
+    async def config(self, configPkt):
+        """Send an already built (and, if needed, encrypted) config packet."""
+        if len(configPkt) != 92:
+            raise DfuError("illegal configPkt length {}/{}".format(len(configPkt),92))
+        with self.report.phase("config"):
+            await self.command(Serial_Op_Code.Config, configPkt, timeout_s=5)
+
+    async def transfer(self, opCode, binary, notifyChunkSz=2048, window=None):
+        """Send 'binary' in chunks, keeping up to 'window' (default self.window)
+        in flight.  Raises WindowFailed if a chunk fails while others are in
+        flight."""
+        with self.report.phase("transfer"):
+            await self._transfer(opCode, binary, notifyChunkSz, window or self.window)
+
+    async def _transfer(self, opCode, binary, notifyChunkSz, window):
+        #chunks are slices of the view, copied only when they are framed
+        binary = memoryview(binary)
+        planner = self.planner
+
+        #a chunk turned away with 'patch input full' can't be resent once the
+        #device has taken a later one, so patch chunks go one at a time
+        if opCode == Serial_Op_Code.Patch_Xfer and window > 1:
+            self.log(1,"patch chunks are sent one at a time, ignoring window={}".format(window))
+            window = 1
+
+        imageTotalSz = len(binary)
+        notifySz = notifyChunkSz
+        offset = 0
+        acked = 0
+        retries = 0
+        pauses = 0
+        pausedSince = None
+
+        #(start, end, frame size, time sent) of chunks not yet acknowledged, oldest first
+        inFlight = deque()
+
+        while(acked < imageTotalSz):
+            #keep up to 'window' chunks in flight, but probe the frame size alone
+            curWindow = 1 if planner.probing else window
+            while(offset < imageTotalSz and len(inFlight) < curWindow and
+                  (not inFlight or offset // WINDOW_SYNC_SZ == inFlight[0][0] // WINDOW_SYNC_SZ)):
+                curChunkSz = planner.chunkSize(binary,offset)
+                txBytes = binary[offset:(offset+curChunkSz)]
+
+                frameSz = self.send(opCode,txBytes)
+                self.report.chunkSent(frameSz, curChunkSz)
+                inFlight.append((offset, offset+curChunkSz, frameSz, time.perf_counter()))
+                offset += curChunkSz
+
+            #responses arrive in the order the chunks were sent
+            start, end, frameSz, sentAt = inFlight.popleft()
+
+            if end != imageTotalSz:
+                expStatus = Serial_Op_Status.Success_Need_Addl_Data
+            else:
+                expStatus = Serial_Op_Status.Success
+
+            status = await self.receiveStatus(opCode, self.chunkTimeout)
+            if status is not None:
+                self.report.chunkAnswered(time.perf_counter() - sentAt)
+
+            #device rejected the frame size, retry the chunk with a smaller frame
+            if status == Serial_Op_Status.Data_Sz_Err and planner.probing and planner.reduce(frameSz):
+                self.log(1,"frame of {} bytes rejected, trying {} bytes".format(frameSz, planner.maxFrame))
+                offset = start
+                continue
+
+            #the device's patch input is full and the chunk wasn't taken,
+            #give it time to catch up and resend from there
+            if status == Serial_Op_Status.Patch_Input_Full and opCode == Serial_Op_Code.Patch_Xfer:
+                if pausedSince is None:
+                    pausedSince = time.perf_counter()
+                await self._pauseInput(start, pauses, pausedSince)
+                pauses += 1
+                offset = start
+                continue
+
+            if status != expStatus:
+                if curWindow > 1:
+                    await self._windowFailed(opCode, start, status, expStatus, inFlight)
+                await self._retryChunk(start, status, expStatus, retries)
+                retries += 1
+                offset = start
+                continue
+
+            planner.accepted(frameSz)
+            self.log(1,"rxOpResponse OK - op {}, status {}".format(opCode,expStatus))
+            acked = end
+            retries = 0
+            pauses = 0
+            pausedSince = None
+
+            #notify progress
+            if(acked >= notifySz or acked == imageTotalSz):
+                notifySz += notifyChunkSz
+                self.log(0,"xfered {}/{} bytes".format(acked, imageTotalSz))
+
+        self.log(0,"Success")
+
+    async def _windowFailed(self, opCode, start, status, expStatus, inFlight):
+        """Stop a windowed transfer after the chunk at 'start' failed.
+
+        The device appends chunks in the order they arrive and answers are
+        matched to chunks only by order, so once one goes wrong it isn't known
+        which chunks were taken.  The answers still due are drained and
+        WindowFailed raised, for the update to be started over."""
+        while inFlight:
+            inFlight.popleft()
+            if await self.receiveStatus(opCode, self.chunkTimeout) is None:
+                break
+        self.link.discardFrames()
+        self.log(0,"Fail")
+        raise WindowFailed("chunk at {} failed with chunks in flight, status {}/{}".format(start, status, expStatus))
+
+    async def _retryChunk(self, start, status, expStatus, retries):
+        """Decide whether the chunk at 'start' can be resent; raises DfuError if not."""
+        if status not in RETRY_STATUSES:
+            self.log(0,"Fail")
+            raise DfuError("chunk at {} failed, status {}/{}".format(start, status, expStatus))
+
+        if retries >= self.retries:
+            self.log(0,"Fail")
+            raise DfuError("chunk at {} failed {} times, giving up".format(start, retries + 1))
+
+        #a late answer would be taken for the resent chunk's
+        self.link.discardFrames()
+
+        self.report.retried()
+        self.log(0,"chunk at {} failed (status {}), resending {}/{}".format(start, status, retries + 1, self.retries))
+
+    async def _pauseInput(self, start, pauses, pausedSince):
+        """Back off before resending a patch chunk the device had no room for."""
+        begin = time.perf_counter()
+        waited = begin - pausedSince
+        if waited >= PATCH_FULL_TIMEOUT:
+            self.log(0,"Fail")
+            raise DfuError("patch input still full after {:.1f}s at {}".format(waited, start))
+
+        delay = min(PATCH_FULL_PAUSE_MIN * (2 ** pauses), PATCH_FULL_PAUSE_MAX)
+        self.log(1,"patch input full at {}, resending in {:.0f}ms".format(start, delay * 1000))
+        await asyncio.sleep(delay)
+        self.report.paused(time.perf_counter() - begin)
+
+    async def _upload(self, image, window):
+        #start message
+        self.log(0,"\nStarting DFU...")
+        await self.start(image.startBin)
+
+        #init message
+        self.log(0,"\nIniting DFU...")
+        await self.init(image.initBin)
+
+        if image.patch:
+            #init patch message
+            self.log(0,"\nInitializing Patch...")
+            await self.initPatch(image.patchInitBin)
+
+            #patch transfer
+            self.log(0,"\nUploading image...")
+            await self.transfer(Serial_Op_Code.Patch_Xfer, image.imageBin, notifyChunkSz=1, window=window)
+        else:
+            #image transfer
+            self.log(0,"\nUploading image...")
+            await self.transfer(Serial_Op_Code.Image_Xfer, image.imageBin, window=window)
+
+    async def isCurrent(self, image):
+        """Whether the device already runs the bootloader version in 'image'."""
+        if image.info is None:
+            return False
+        await self.ensureActive()
+        return self.version == image.info.banner()
+
+    async def dfu(self, image):
+        """Run a complete update (or patch) with a DfuImage from loadImage().
+
+        If a windowed transfer fails, the update is started again from the
+        start packet with one chunk at a time."""
+        try:
+            await self._upload(image, self.window)
+        except WindowFailed as e:
+            self.log(0,"{}, restarting the update with window=1".format(e))
+            self.report.restarts += 1
+            await self._upload(image, 1)
+
+        #image validation
+        self.log(0,"\nValidating image...")
+        await self.validate()
+
+        #image activation
+        self.log(0,"\nActivating image...")
+        with self.report.phase("activate"):
+            await self.activateAndReset()
+
+            self.log(0,"\nWaiting for activation...")
+            await asyncio.sleep(1)
+
+        self.log(0,"\nDFU Complete!")
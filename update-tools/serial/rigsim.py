@@ -0,0 +1,468 @@
+#!/usr/bin/python
+
+'''
+  RigDFU2 serial loader simulator
+
+  Presents a pseudo-terminal that behaves like a module running the RigDFU2
+  serial loader, so dfu.py and fleet.py can be run and benchmarked without
+  hardware:
+
+    with RigDfuSim(flashDelay=0.002) as sim:
+        asyncio.run(update(sim.port))
+        print(sim.images[-1].crc)
+
+  The loader answers the activation magic with its version banner and then
+  handles Start, Init, InitPatch, Image_Xfer, Patch_Xfer, Validate,
+  Activate_N_Reset and Config frames.  Received image data is reassembled
+  (and decrypted, if the simulator has a key) and kept in 'images' once the
+  image is activated.  Patches are applied to the current application
+  ('app') with rigpatch and checked against the CRCs in the patch init
+  packet, as the bootloader does.
+
+  Bytes are delayed to the rate the host set on the port, and each transfer
+  chunk takes 'flashDelay' to write; frames keep arriving while a chunk is
+  being written.  Patch data goes through an input buffer of 'patchBuffer'
+  bytes (None for no limit) that is applied at 'patchRate' bytes a second;
+  a patch chunk that doesn't fit is answered with Patch_Input_Full and
+  dropped, as the bootloader does.  'faults' maps transfer chunk numbers (counted from 0
+  across the session) to a Serial_Op_Status to answer with instead, or to
+  None to drop the chunk without an answer.  Faults fire once.
+
+  Needs a POSIX pty, so it doesn't run on Windows.
+
+  @copyright (c) Rigado, LLC. All rights reserved.
+
+  Source code licensed under BMD Software License Agreement.
+  You should have received a copy with purchase of Rigado product.
+  If not, contact info@rigado.com for for a copy.
+'''
+
+from collections import namedtuple
+from struct import unpack
+import argparse
+import binascii
+import os
+import pty
+import queue
+import re
+import select
+import sys
+import termios
+import threading
+import time
+import tty
+import zlib
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","..","image-tools","common"))
+
+import framing
+import rigcrypto
+import rigpatch
+from chunkplanner import frameLength
+from rigdfu import (Serial_Op_Code, Serial_Op_Status, ACTIVATE_MAGIC, StartPkt,
+                    start_packet_size, init_packet_size, patch_init_packet_size)
+
+#an image received and activated by the simulator; data is the plaintext
+SimImage = namedtuple('SimImage', 'startPkt patch data crc')
+
+#termios speed constants back to bits per second
+_RATES = dict((getattr(termios, name), int(name[1:]))
+              for name in dir(termios) if re.match(r'^B\d+$', name))
+
+#fault names for the command line
+FAULTS = {
+    'state':  Serial_Op_Status.Invalid_State_Err,
+    'size':   Serial_Op_Status.Data_Sz_Err,
+    'crc':    Serial_Op_Status.CRC_Err,
+    'failed': Serial_Op_Status.Op_Failed_Err,
+    'full':   Serial_Op_Status.Patch_Input_Full,
+    'drop':   None,
+}
+
+def deviceKey(key):
+    """'key' as bytes, or None for an unkeyed device: like the loader (and
+    dfu.py), an all 0x00 or all 0xFF key means no key."""
+    if not key or set(key) in ({0x00}, {0xFF}):
+        return None
+    return bytes(key)
+
+class RigDfuSim(object):
+    """One simulated RigDFU2 module behind a pty.
+
+    maxBaud is the fastest rate the loader answers at (None for any),
+    maxFrame the largest escaped frame it accepts (None for any), key the
+    16 byte device key (None, all 0x00 or all 0xFF for an unkeyed device), bootDelay how long
+    the loader takes to come up after open() or a reset and app the
+    application patches are applied to."""
+
+    def __init__(self, version="3.3.1 (46)", flashDelay=0.0, throttle=True,
+                 maxBaud=None, maxFrame=None, key=None, faults=None,
+                 bootDelay=0.0, mac=None, app=b'', patchBuffer=None,
+                 patchRate=16384, log=None):
+        self.version = version
+        self.flashDelay = flashDelay
+        self.throttle = throttle
+        self.maxBaud = maxBaud
+        self.maxFrame = maxFrame
+        self.key = deviceKey(key)
+        self.mac = bytes(mac) if mac else bytes(6)
+        self.faults = dict(faults or {})
+        self.bootDelay = bootDelay
+        self.app = bytes(app)
+        self.patchBuffer = patchBuffer
+        self.patchRate = patchRate
+        self.log = log or (lambda msg: None)
+
+        self.port = None
+        self.images = []
+        self.chunks = 0
+        self.inputFull = 0
+        self.activations = 0
+        self.rxBytes = 0
+
+        self.master = None
+        self.slave = None
+        self.events = queue.Queue()
+        self.threads = []
+        self._reset()
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self):
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.bootTime = time.monotonic() + self.bootDelay
+
+        self.threads = [threading.Thread(target=self._receive, daemon=True),
+                        threading.Thread(target=self._process, daemon=True)]
+        for t in self.threads:
+            t.start()
+        return self.port
+
+    def close(self):
+        if self.master is None:
+            return
+        self.events.put(None)
+        for fd in (self.slave, self.master):
+            os.close(fd)
+        for t in self.threads:
+            t.join(1)
+        self.master = None
+        self.slave = None
+
+    def _reset(self):
+        #state of the loader, lost when the device resets
+        self.active = False
+        self.startPkt = None
+        self.initBin = None
+        self.patchInit = None
+        self.received = bytearray()
+        self.validated = False
+        self.patchFill = 0.0
+        self.patchApplied = time.monotonic()
+
+    def lineRate(self):
+        """Rate the host has set on the port."""
+        try:
+            return _RATES.get(termios.tcgetattr(self.slave)[4])
+        except termios.error:
+            return None
+
+    def _lineTime(self, nbytes):
+        rate = self.lineRate()
+        if not self.throttle or not rate:
+            return 0.0
+        #8N1, ten bits a byte
+        return nbytes * 10.0 / rate
+
+    def _receive(self):
+        """Read the host side, delayed to the line rate, and queue what arrives."""
+        assembler = framing.FrameAssembler()
+        tail = b''
+        lineFree = 0.0
+        while True:
+            try:
+                select.select([self.master], [], [])
+                data = os.read(self.master, 4096)
+            except (OSError, ValueError):
+                return
+
+            lineFree = max(lineFree, time.monotonic()) + self._lineTime(len(data))
+            delay = lineFree - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.rxBytes += len(data)
+
+            #the magic may be split across reads, and image data may contain it;
+            #once active only a magic sent outside of a frame counts
+            found = (tail + data).find(ACTIVATE_MAGIC)
+            if found >= 0:
+                if not self.active or (assembler.frame is None and b'\xaa' not in (tail + data)[:found]):
+                    self.events.put(('magic', lineFree))
+            tail = (tail + data)[-(len(ACTIVATE_MAGIC) - 1):]
+
+            for frame in assembler.feed(data):
+                self.events.put(('frame', lineFree, frame))
+
+    def _process(self):
+        flashFree = 0.0
+        while True:
+            event = self.events.get()
+            if event is None:
+                return
+
+            if event[0] == 'magic':
+                self._onMagic()
+                continue
+
+            arrived, frame = event[1], event[2]
+            if not self.active:
+                continue
+
+            opCode, payload = frame[2], frame[3:]
+            if opCode in (Serial_Op_Code.Image_Xfer, Serial_Op_Code.Patch_Xfer):
+                #chunks are written one after another, but keep arriving meanwhile
+                flashFree = max(flashFree, arrived) + self.flashDelay
+                delay = flashFree - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+            try:
+                status = self.handle(opCode, payload)
+            except Exception as e:
+                self.log("error handling op {}: {}".format(opCode, e))
+                status = Serial_Op_Status.Op_Failed_Err
+
+            if status is not None:
+                self._write(framing.encodeFrame(Serial_Op_Code.Response, bytes((opCode, status))))
+
+            if opCode == Serial_Op_Code.Activate_N_Reset and status == Serial_Op_Status.Success:
+                self._activateImage()
+
+    def _write(self, data):
+        time.sleep(self._lineTime(len(data)))
+        try:
+            os.write(self.master, data)
+        except OSError:
+            pass
+
+    def _onMagic(self):
+        if time.monotonic() < self.bootTime:
+            return
+
+        rate = self.lineRate()
+        if self.maxBaud and rate and rate > self.maxBaud:
+            #the loader can't keep up, the host only sees noise
+            self._write(os.urandom(8).replace(b'\xaa', b'\x00'))
+            return
+
+        self._reset()
+        self.active = True
+        self.activations += 1
+        self.log("activated at {} baud".format(rate))
+        self._write("{}\r\n".format(self.version).encode("ascii"))
+
+    def handle(self, opCode, payload):
+        """Answer one request frame; returns the status, or None to stay quiet."""
+        if opCode == Serial_Op_Code.Start:
+            if len(payload) != start_packet_size:
+                return Serial_Op_Status.Data_Sz_Err
+            self._reset()
+            self.active = True
+            self.startPkt = StartPkt._make(unpack('<LLL', payload))
+            return Serial_Op_Status.Success
+
+        if opCode == Serial_Op_Code.Init:
+            if self.startPkt is None:
+                return Serial_Op_Status.Invalid_State_Err
+            if len(payload) != init_packet_size:
+                return Serial_Op_Status.Data_Sz_Err
+            self.initBin = bytes(payload)
+            return Serial_Op_Status.Success
+
+        if opCode == Serial_Op_Code.InitPatch:
+            if self.initBin is None or self.received:
+                return Serial_Op_Status.Invalid_State_Err
+            if len(payload) != patch_init_packet_size:
+                return Serial_Op_Status.Data_Sz_Err
+            self.patchInit = unpack('<LLL', payload)
+            return Serial_Op_Status.Success
+
+        if opCode in (Serial_Op_Code.Image_Xfer, Serial_Op_Code.Patch_Xfer):
+            return self._onChunk(opCode, payload)
+
+        if opCode == Serial_Op_Code.Validate:
+            return self._validate()
+
+        if opCode == Serial_Op_Code.Activate_N_Reset:
+            if not self.validated:
+                return Serial_Op_Status.Invalid_State_Err
+            return Serial_Op_Status.Success
+
+        if opCode == Serial_Op_Code.Config:
+            return self._config(payload)
+
+        return Serial_Op_Status.Not_Supported_Err
+
+    def _expected(self):
+        if self.patchInit is not None:
+            return self.patchInit[0]
+        return sum(self.startPkt)
+
+    def _onChunk(self, opCode, payload):
+        chunk = self.chunks
+        self.chunks += 1
+
+        if chunk in self.faults:
+            status = self.faults.pop(chunk)
+            self.log("chunk {}: injected {}".format(chunk, "drop" if status is None else Serial_Op_Status(status).name))
+            return status
+
+        if self.initBin is None:
+            return Serial_Op_Status.Invalid_State_Err
+        if (opCode == Serial_Op_Code.Patch_Xfer) != (self.patchInit is not None):
+            return Serial_Op_Status.Invalid_State_Err
+        if self.maxFrame and frameLength(payload) > self.maxFrame:
+            return Serial_Op_Status.Data_Sz_Err
+        if len(self.received) + len(payload) > self._expected():
+            return Serial_Op_Status.Data_Sz_Err
+        if opCode == Serial_Op_Code.Patch_Xfer and not self._patchInput(len(payload)):
+            self.inputFull += 1
+            return Serial_Op_Status.Patch_Input_Full
+
+        self.received += payload
+        if len(self.received) < self._expected():
+            return Serial_Op_Status.Success_Need_Addl_Data
+        return Serial_Op_Status.Success
+
+    def _patchInput(self, size):
+        """Take 'size' bytes into the patch input buffer if they fit."""
+        now = time.monotonic()
+        self.patchFill = max(0.0, self.patchFill - (now - self.patchApplied) * self.patchRate)
+        self.patchApplied = now
+        if self.patchBuffer is not None and self.patchFill + size > self.patchBuffer:
+            return False
+        self.patchFill += size
+        return True
+
+    def _plaintext(self):
+        iv, tag = self.initBin[:16], self.initBin[16:]
+        if not (any(iv) or any(tag)):
+            return bytes(self.received)
+        if self.key is None:
+            raise rigcrypto.SignError("encrypted image sent to a device without a key")
+        return rigcrypto.eaxDecrypt(self.key, iv, self.startBinary(), bytes(self.received), tag)
+
+    def startBinary(self):
+        return b''.join(n.to_bytes(4, 'little') for n in self.startPkt)
+
+    def _validate(self):
+        if self.startPkt is None or self.initBin is None or len(self.received) != self._expected():
+            return Serial_Op_Status.Invalid_State_Err
+
+        if self.patchInit is None:
+            try:
+                self.plaintext = self._plaintext()
+            except rigcrypto.SignError as e:
+                self.log("validate failed: " + str(e))
+                return Serial_Op_Status.Op_Failed_Err
+        else:
+            try:
+                self.plaintext = self._patched()
+            except rigpatch.PatchError as e:
+                self.log("patch failed: " + str(e))
+                return Serial_Op_Status.Op_Failed_Err
+
+        self.validated = True
+        return Serial_Op_Status.Success
+
+    def _patched(self):
+        patchLen, crc, oldCrc = self.patchInit
+        if rigpatch.crc32(self.app) != oldCrc:
+            raise rigpatch.PatchError("old application crc32 {:08x} != {:08x}".format(rigpatch.crc32(self.app), oldCrc))
+
+        new = rigpatch.apply(self.app, self.received)
+        if len(new) != self.startPkt.app or rigpatch.crc32(new) != crc:
+            raise rigpatch.PatchError("patched application doesn't match its length or crc32")
+        return new
+
+    def _activateImage(self):
+        image = SimImage(self.startPkt, self.patchInit is not None, self.plaintext,
+                         zlib.crc32(self.plaintext) & 0xFFFFFFFF)
+        self.images.append(image)
+        if self.startPkt.app:
+            self.app = image.data
+        self.log("activated {} of {} bytes, crc32 {:08x}".format(
+            "patch" if image.patch else "image", len(image.data), image.crc))
+
+        #the device resets, the host has to activate the loader again
+        self._reset()
+        self.bootTime = time.monotonic() + self.bootDelay
+
+    def _config(self, payload):
+        if len(payload) != 92:
+            return Serial_Op_Status.Data_Sz_Err
+
+        if self.key is None:
+            plain = bytes(payload)
+        else:
+            try:
+                plain = rigcrypto.unsignImage(bytes(payload), self.key)
+            except rigcrypto.SignError as e:
+                self.log("config rejected: " + str(e))
+                return Serial_Op_Status.Op_Failed_Err
+
+        data = plain[rigcrypto.HEADER_SZ:]
+        oldKey, newKey, mac = data[:16], data[16:32], data[32:38]
+        if self.key is not None and oldKey != self.key:
+            return Serial_Op_Status.Op_Failed_Err
+
+        if any(newKey) and set(newKey) != {0xFF}:
+            self.key = bytes(newKey)
+        if any(mac):
+            self.mac = bytes(mac)
+        self.log("configured mac {} key {}".format(binascii.hexlify(self.mac[::-1]).decode(),
+            binascii.hexlify(self.key).decode() if self.key else None))
+        return Serial_Op_Status.Success
+
+def parseFault(spec):
+    """'N:kind' -> (N, status), e.g. '3:crc' or '10:drop'."""
+    try:
+        chunk, kind = spec.split(":")
+        return int(chunk), FAULTS[kind]
+    except (ValueError, KeyError):
+        raise argparse.ArgumentTypeError("fault must be N:{}".format("|".join(sorted(FAULTS))))
+
+def main():
+    parser = argparse.ArgumentParser(description="RigDFU2 Serial Loader Simulator")
+    parser.add_argument("--version",    type=str, help="version banner [3.3.1 (46)]", default="3.3.1 (46)")
+    parser.add_argument("--flashdelay", type=float, help="seconds to write each chunk [0]", default=0.0)
+    parser.add_argument("--maxbaud",    type=int, help="fastest rate the loader answers at")
+    parser.add_argument("--maxframe",   type=int, help="largest escaped frame accepted")
+    parser.add_argument("--key",        type=str, help="device key (16 bytes)")
+    parser.add_argument("--patchbuffer", type=int, help="patch input buffer size in bytes")
+    parser.add_argument("--patchrate",  type=int, help="patch bytes applied a second [16384]", default=16384)
+    parser.add_argument("--fault",      type=parseFault, action="append", help="inject a fault, N:kind", default=[])
+    parser.add_argument("--nothrottle", action="store_true", help="don't delay bytes to the line rate")
+    args = parser.parse_args()
+
+    key = binascii.a2b_hex(args.key) if args.key else None
+    sim = RigDfuSim(args.version, args.flashdelay, not args.nothrottle, args.maxbaud,
+                    args.maxframe, key, dict(args.fault), patchBuffer=args.patchbuffer,
+                    patchRate=args.patchrate, log=print)
+    with sim:
+        print("RigDFU2 simulator on {}".format(sim.port))
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == "__main__":
+    main()
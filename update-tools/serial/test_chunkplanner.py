@@ -0,0 +1,67 @@
+"""Test suite for transfer chunk sizing."""
+
+import unittest
+
+import framing
+from chunkplanner import ChunkPlanner, frameLength
+
+
+class ChunkPlannerTest(unittest.TestCase):
+
+    def test_fixed_size(self):
+        planner = ChunkPlanner(192)
+        image = b'\xaa' * 500
+        self.assertEqual(192, planner.chunkSize(image, 0))
+        self.assertEqual(116, planner.chunkSize(image, 384))
+
+    def test_auto_uses_largest_payload(self):
+        planner = ChunkPlanner.auto()
+        self.assertEqual(252, planner.chunkSize(b'\x00' * 1000, 0))
+
+    def test_auto_fits_escaped_frame(self):
+        planner = ChunkPlanner.auto()
+        image = (b'\x00\xaa' * 1000)
+        size = planner.chunkSize(image, 0)
+        self.assertEqual(0, size % 4)
+        self.assertLessEqual(frameLength(image[:size]), planner.maxFrame)
+        self.assertGreater(frameLength(image[:size + 4]), planner.maxFrame)
+
+    def test_frame_length_matches_encoder(self):
+        for n in (0, 1, 168, 169, 170, 253):
+            chunk = b'\xab' * n
+            self.assertEqual(len(framing.encodeFrame(3, chunk)), frameLength(chunk))
+
+    def test_chunk_fits_frame(self):
+        #the smallest frame that fits 4 escaped bytes
+        planner = ChunkPlanner(252, maxFrame=11, align=4)
+        image = b'\xaa' * 100
+        self.assertEqual(4, planner.chunkSize(image, 0))
+        self.assertLessEqual(frameLength(image[:4]), 11)
+        with self.assertRaises(ValueError):
+            ChunkPlanner(252, maxFrame=10, align=4)
+
+    def test_probing_needs_full_frame(self):
+        planner = ChunkPlanner.auto()
+        planner.reduce(256)
+        #a short final chunk doesn't show that 224 byte frames fit
+        planner.accepted(100)
+        self.assertTrue(planner.probing)
+        planner.accepted(193)
+        self.assertFalse(planner.probing)
+
+        planner = ChunkPlanner.auto()
+        planner.reduce(65)
+        planner.accepted(20)
+        self.assertFalse(planner.probing)
+
+    def test_reduce(self):
+        planner = ChunkPlanner.auto()
+        self.assertTrue(planner.reduce(256))
+        self.assertEqual(224, planner.maxFrame)
+        self.assertEqual(220, planner.maxPayload)
+        self.assertTrue(planner.reduce(65))
+        self.assertFalse(planner.reduce(64))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import json
+import os
+import tempfile
+import unittest
+
+import dfureport
+from dfureport import SessionReport
+
+class TestSessionReport(unittest.TestCase):
+
+    def test_histogram(self):
+        report = SessionReport("port")
+        for rtt in (0.0005, 0.001, 0.003, 0.015, 20.0):
+            report.chunkAnswered(rtt)
+
+        hist = report.histogram()
+        self.assertEqual(hist["<=1ms"], 2)
+        self.assertEqual(hist["<=5ms"], 1)
+        self.assertEqual(hist["<=20ms"], 1)
+        self.assertEqual(hist[">10000ms"], 1)
+        self.assertEqual(sum(hist.values()), 5)
+
+    def test_summary(self):
+        report = SessionReport("port")
+        with report.phase("transfer"):
+            pass
+        with report.phase("activation"):
+            pass
+        with report.phase("activation"):
+            pass
+        report.chunkSent(200, 192)
+        report.chunkSent(100, 100)
+        report.retried()
+        report.paused(0.25)
+        report.paused(0.5)
+        report.finish(Exception("failed"))
+
+        summary = report.asDict()
+        self.assertEqual([p["name"] for p in summary["phases"]], ["transfer", "activation", "activation"])
+        self.assertEqual(set(summary["phaseTotals"]), {"transfer", "activation"})
+        self.assertEqual(summary["transfer"]["chunks"], 2)
+        self.assertEqual(summary["transfer"]["retries"], 1)
+        self.assertEqual(summary["transfer"]["restarts"], 0)
+        self.assertEqual(summary["transfer"]["inputFull"], 2)
+        self.assertAlmostEqual(summary["transfer"]["pausedSeconds"], 0.75)
+        self.assertAlmostEqual(summary["transfer"]["escapeOverhead"], 8 / 292.0)
+        self.assertFalse(summary["ok"])
+        self.assertEqual(summary["error"], "failed")
+        self.assertIsNone(summary["chunkRtt"]["p50Ms"])
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(dfureport.percentile(values, 50), 50)
+        self.assertEqual(dfureport.percentile(values, 95), 95)
+        self.assertEqual(dfureport.percentile(values, 100), 100)
+        self.assertEqual(dfureport.percentile([7], 95), 7)
+
+    def test_write(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+
+        dfureport.writeReports(path, [SessionReport("a").finish(), SessionReport("b").finish()])
+        with open(path) as f:
+            self.assertEqual([r["port"] for r in json.load(f)], ["a", "b"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import argparse
+import asyncio
+import os
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+#rigsim puts image-tools/common on the path for rigcrypto
+from rigsim import RigDfuSim
+import fleet
+import rigcrypto
+
+class TestConfigs(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.baudCache = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(self.baudCache)
+        self.addCleanup(lambda: os.path.exists(self.baudCache) and os.remove(self.baudCache))
+
+    def manifest(self, text):
+        fd, path = tempfile.mkstemp(suffix=".csv")
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_read(self):
+        path = self.manifest("port,mac,oldkey,newkey\n"
+                             "# comment\n"
+                             "/dev/a, 01:02:03:04:05:06, , " + "11" * 16 + "\n"
+                             "/dev/b,," + "11" * 16 + "," + "22" * 16 + "\n")
+        lines = fleet.readConfigManifest(path)
+        self.assertEqual([line.port for line in lines], ["/dev/a", "/dev/b"])
+        self.assertEqual(lines[0].mac, bytes((6, 5, 4, 3, 2, 1)))
+        self.assertEqual(lines[0].oldkey, bytes(16))
+        self.assertEqual(lines[1].mac, bytes(6))
+        self.assertEqual(lines[1].newkey, b'\x22' * 16)
+
+        #an old key alone is no operation
+        path = self.manifest("/dev/c,," + "11" * 16 + ",\n")
+        with self.assertRaises(SystemExit):
+            fleet.readConfigManifest(path)
+
+    def test_rotate(self):
+        oldKeys = [os.urandom(16) for i in range(3)]
+        newKeys = [os.urandom(16) for i in range(3)]
+        sims = [RigDfuSim(key=key) for key in oldKeys]
+        for sim in sims:
+            sim.open()
+            self.addCleanup(sim.close)
+
+        path = self.manifest("".join("{},,{},{}\n".format(sim.port, old.hex(), new.hex())
+                                     for sim, old, new in zip(sims, oldKeys, newKeys)))
+        jobs = fleet.configJobs(fleet.readConfigManifest(path), workers=2)
+        self.assertTrue(all(job.config is not None and job.image is None for job in jobs))
+
+        #the second device has already been rotated
+        sims[1].key = newKeys[1]
+
+        options = argparse.Namespace(baud=115200, baudcache=self.baudCache, chunk="192", window=1,
+                                     retries=3, skipcurrent=False)
+        reports = []
+        results = asyncio.run(fleet.runJobs(jobs, options, fleet.ImageCache(False), 3, reports))
+
+        self.assertEqual([r.ok for r in results], [True, False, True])
+        self.assertFalse(any(r.skipped for r in results))
+        self.assertEqual([sim.key for sim in sims], newKeys)
+        self.assertEqual(len(reports), 3)
+
+class TestRunJobs(unittest.TestCase):
+
+    def test_prepare(self):
+        fd, path = tempfile.mkstemp(suffix=".bin")
+        with os.fdopen(fd, "wb") as f:
+            f.write(struct.pack('<3I', 0, 0, 1024) + bytes(32) + os.urandom(1024))
+        self.addCleanup(os.remove, path)
+
+        keys = [os.urandom(16) for i in range(3)]
+        jobs = [fleet.Job("/dev/a", path, keys[0]), fleet.Job("/dev/b", path, keys[1]),
+                fleet.Job("/dev/c", path, keys[0]), fleet.Job("/dev/d", path, keys[2]),
+                fleet.Job("/dev/e", path, None), fleet.Job("/dev/f", path + ".missing", keys[0])]
+        images = fleet.ImageCache(False)
+        images.prepare(jobs, workers=2)
+        self.assertEqual(len(images.images), 5)
+
+        #nothing is encrypted once the transfers are running
+        with mock.patch.object(fleet, "encryptImage", side_effect=AssertionError("encrypted on the loop")):
+            for key in keys:
+                image = images.get(path, key)
+                plain = rigcrypto.unsignImage(bytes(image.startBin) + bytes(image.initBin) + bytes(image.imageBin), key)
+            self.assertEqual(images.get(path, None).startPkt.app, 1024)
+            self.assertEqual(len(plain), 12 + 32 + 1024)
+            with self.assertRaises(FileNotFoundError):
+                images.get(path + ".missing", keys[0])
+
+    def test_failure_is_per_port(self):
+        fd, path = tempfile.mkstemp(suffix=".bin")
+        with os.fdopen(fd, "wb") as f:
+            f.write(struct.pack('<3I', 0, 0, 1024) + bytes(32) + os.urandom(1024))
+        self.addCleanup(os.remove, path)
+        fd, baudCache = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, baudCache)
+
+        with RigDfuSim() as good, RigDfuSim() as other:
+            #the missing image raises FileNotFoundError, not DfuError
+            jobs = [fleet.Job(other.port, path + ".missing", b'\x11' * 16), fleet.Job(good.port, path, None)]
+            options = argparse.Namespace(baud=115200, baudcache=baudCache, chunk="192", window=1,
+                                         retries=3, skipcurrent=False)
+            reports = []
+            results = asyncio.run(fleet.runJobs(jobs, options, fleet.ImageCache(False), 2, reports))
+
+        self.assertEqual([r.ok for r in results], [False, True])
+        self.assertIn("FileNotFoundError", results[0].error)
+        self.assertEqual(len(good.images), 1)
+
+if __name__ == '__main__':
+    unittest.main()
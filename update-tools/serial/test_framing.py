@@ -0,0 +1,109 @@
+"""Test suite for the RigDFU2 serial frame codec."""
+
+import os
+import random
+import unittest
+
+import framing
+
+
+class EscapeTest(unittest.TestCase):
+
+    def test_escape_special_bytes(self):
+        self.assertEqual(b'\x01\xab\xac\x02\xab\xab\x03',
+                         framing.escape(b'\x01\xaa\x02\xab\x03'))
+
+    def test_escape_plain_bytes_unchanged(self):
+        data = bytes(b for b in range(256) if b not in (0xAA, 0xAB))
+        self.assertEqual(data, framing.escape(data))
+
+    def test_unescape_is_not_sequential_replace(self):
+        # escaped 0xAB followed by a literal 0xAC
+        self.assertEqual(b'\xab\xac', framing.unescape(b'\xab\xab\xac'))
+
+    def test_round_trip(self):
+        rnd = random.Random(1234)
+        for n in (0, 1, 2, 192, 253, 4096):
+            data = bytes(rnd.choice((0xAA, 0xAB, 0xAC, 0x00, 0xFF)) for _ in range(n))
+            escaped = framing.escape(data)
+            self.assertNotIn(0xAA, escaped)
+            self.assertEqual(len(escaped), framing.escapedLength(data))
+            self.assertEqual(data, framing.unescape(escaped))
+
+    def test_round_trip_all_bytes(self):
+        data = bytes(range(256)) * 4 + os.urandom(1024)
+        self.assertEqual(data, framing.unescape(framing.escape(data)))
+
+    def test_illegal_escape(self):
+        self.assertRaises(framing.FrameError, framing.unescape, b'\x01\xab\x02')
+
+    def test_truncated_escape(self):
+        self.assertRaises(framing.FrameError, framing.unescape, b'\x01\xab')
+
+
+class EncodeFrameTest(unittest.TestCase):
+
+    def test_no_payload(self):
+        self.assertEqual(b'\xaa\x02\x04', framing.encodeFrame(4))
+
+    def test_payload(self):
+        self.assertEqual(b'\xaa\x05\x03\x01\xab\xac\x02',
+                         framing.encodeFrame(3, b'\x01\xaa\x02'))
+
+    def test_escaped_length(self):
+        # 0xA8 + 2 == 0xAA must be escaped in the length field
+        frame = framing.encodeFrame(3, b'\x00' * 0xA8)
+        self.assertEqual(b'\xaa\xab\xac\x03', frame[:4])
+
+    def test_payload_too_long(self):
+        self.assertRaises(framing.FrameError, framing.encodeFrame, 3,
+                          b'\x00' * (framing.MAX_PAYLOAD + 1))
+
+
+class FrameDecoderTest(unittest.TestCase):
+
+    def test_split_escape(self):
+        decoder = framing.FrameDecoder()
+        self.assertEqual(b'\x01', decoder.feed(b'\x01\xab'))
+        self.assertTrue(decoder.needsMore())
+        self.assertEqual(b'\xaa\x02', decoder.feed(b'\xac\x02'))
+        self.assertFalse(decoder.needsMore())
+
+    def test_byte_at_a_time(self):
+        data = bytes(range(256)) * 2
+        escaped = framing.escape(data)
+        decoder = framing.FrameDecoder()
+        out = b''.join(decoder.feed(escaped[i:i+1]) for i in range(len(escaped)))
+        self.assertEqual(data, out)
+
+    def test_even_escape_run(self):
+        decoder = framing.FrameDecoder()
+        self.assertEqual(b'\xab', decoder.feed(b'\xab\xab'))
+        self.assertFalse(decoder.needsMore())
+
+
+class FrameAssemblerTest(unittest.TestCase):
+
+    def test_split_frames(self):
+        stream = framing.encodeFrame(16, b'\x03\x07') + framing.encodeFrame(16, b'\xab\x01')
+        assembler = framing.FrameAssembler()
+        frames = []
+        for i in range(len(stream)):
+            frames += assembler.feed(stream[i:i+1])
+        self.assertEqual([b'\xaa\x04\x10\x03\x07', b'\xaa\x04\x10\xab\x01'], frames)
+        self.assertEqual(0, assembler.discarded)
+
+    def test_noise_is_skipped(self):
+        assembler = framing.FrameAssembler()
+        frames = assembler.feed(b'3.2.3 (45)\r\n' + framing.encodeFrame(16, b'\x01\x01'))
+        self.assertEqual([b'\xaa\x04\x10\x01\x01'], frames)
+        self.assertEqual(12, assembler.discarded)
+
+    def test_truncated_frame_resyncs(self):
+        assembler = framing.FrameAssembler()
+        frames = assembler.feed(b'\xaa\x04\x10' + framing.encodeFrame(16, b'\x04\x01'))
+        self.assertEqual([b'\xaa\x04\x10\x04\x01'], frames)
+
+
+if __name__ == '__main__':
+    unittest.main()
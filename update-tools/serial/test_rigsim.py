@@ -0,0 +1,308 @@
+import argparse
+import asyncio
+import json
+import os
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+import serial
+
+#rigsim puts image-tools/common on the path for rigcrypto
+from rigsim import RigDfuSim
+from rigdfu import DfuSession, DfuError, SerialLink, Serial_Op_Status, loadImage, parseImage, parseFirmwareInfo
+import baudrate
+import dfu
+import imagebuild
+import rigcrypto
+import rigpatch
+
+BOOTLOADER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "programming",
+                          "binaries", "rigdfu2_nrf52_s132_sdk12_rel_3.3.1.46.hex")
+
+#keep the hex files loaded here out of the user's hex cache
+hexCache = mock.patch.dict(os.environ, {"RIGADO_HEX_CACHE": "off"})
+
+def setUpModule():
+    hexCache.start()
+
+def tearDownModule():
+    hexCache.stop()
+
+def appImage(size=4096):
+    data = os.urandom(size)
+    return struct.pack('<3I', 0, 0, size) + bytes(32) + data, data
+
+def run(coro):
+    return asyncio.run(coro)
+
+class TestRigDfuSim(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.baudCache = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(self.baudCache)
+        self.addCleanup(lambda: os.path.exists(self.baudCache) and os.remove(self.baudCache))
+
+    def update(self, sim, image, **options):
+        async def go():
+            async with DfuSession(sim.port, baudCache=self.baudCache, **options) as session:
+                await session.dfu(image)
+                return session
+        return run(go())
+
+    def test_update(self):
+        packed, data = appImage()
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, "wb") as f:
+            f.write(packed)
+        self.addCleanup(os.remove, path)
+
+        image = loadImage(path)
+        self.assertIsInstance(image.imageBin, memoryview)
+        with RigDfuSim(flashDelay=0.001, maxFrame=128) as sim:
+            self.update(sim, image, chunk="auto", window=4)
+
+        self.assertEqual(len(sim.images), 1)
+        self.assertEqual(sim.images[0].data, data)
+        self.assertEqual(sim.images[0].startPkt.app, len(data))
+
+    def test_frame_probed_once(self):
+        packed, data = appImage(2048)
+        logs = []
+        with RigDfuSim(maxFrame=128) as sim:
+            async def go():
+                async with DfuSession(sim.port, baudCache=self.baudCache, chunk="auto",
+                                      log=lambda level, message: logs.append(message)) as session:
+                    await session.dfu(parseImage(packed))
+                    probes = len([m for m in logs if "rejected" in m])
+                    await session.dfu(parseImage(packed))
+                    return probes
+            probes = run(go())
+
+        self.assertEqual(probes, 4)
+        self.assertEqual(len([m for m in logs if "rejected" in m]), probes)
+        self.assertEqual([image.data for image in sim.images], [data, data])
+
+    def test_small_image_then_large(self):
+        #the small image's only frame is under the limit, so probing goes on
+        small, smallData = appImage(64)
+        large, largeData = appImage(2048)
+        with RigDfuSim(maxFrame=128) as sim:
+            async def go():
+                async with DfuSession(sim.port, baudCache=self.baudCache, chunk="auto") as session:
+                    await session.dfu(parseImage(small))
+                    await session.dfu(parseImage(large))
+            run(go())
+        self.assertEqual([image.data for image in sim.images], [smallData, largeData])
+
+    def test_encrypted_update_and_config(self):
+        key = bytes(range(16))
+        newKey = bytes(range(16, 32))
+        packed, data = appImage(1024)
+
+        configPkt = bytearray(struct.pack('<3I', 48, 0, 0) + bytes(32))
+        configPkt += key + newKey + bytes(range(6)) + bytes(10)
+
+        async def go(sim):
+            async with DfuSession(sim.port, baudCache=self.baudCache) as session:
+                await session.dfu(parseImage(rigcrypto.signImage(packed, key)))
+                await session.config(rigcrypto.signImage(bytes(configPkt), key))
+
+        with RigDfuSim(key=key) as sim:
+            run(go(sim))
+
+        self.assertEqual(sim.images[0].data, data)
+        self.assertEqual(sim.key, newKey)
+        self.assertEqual(sim.mac, bytes(range(6)))
+
+    def test_wrong_key(self):
+        packed, data = appImage(1024)
+        with RigDfuSim(key=bytes(range(16))) as sim:
+            with self.assertRaises(DfuError):
+                self.update(sim, parseImage(rigcrypto.signImage(packed, bytes(range(16, 32)))))
+        self.assertEqual(sim.images, [])
+
+    def test_blank_key(self):
+        packed, data = appImage(1024)
+        for key in (bytes(16), b'\xff' * 16):
+            with RigDfuSim(key=key) as sim:
+                self.assertIsNone(sim.key)
+                self.update(sim, parseImage(packed))
+            self.assertEqual(sim.images[0].data, data)
+
+    def test_chunk_resent(self):
+        packed, data = appImage(2048)
+        faults = {2: Serial_Op_Status.CRC_Err, 3: Serial_Op_Status.CRC_Err, 6: None}
+        with RigDfuSim(faults=faults) as sim:
+            session = self.update(sim, parseImage(packed), chunkTimeout=0.2)
+
+        self.assertEqual(session.report.retries, 3)
+        self.assertEqual(session.report.chunks, 11 + 3)
+        self.assertEqual(len(session.report.rtts), 11 + 2)
+        self.assertEqual([name for name, seconds in session.report.phases],
+                         ["activation", "start", "init", "transfer", "validate", "activate"])
+        self.assertEqual(sim.images[0].data, data)
+
+    def test_window_fault(self):
+        packed, data = appImage(4096)
+        with RigDfuSim(faults={2: Serial_Op_Status.CRC_Err}) as sim:
+            session = self.update(sim, parseImage(packed), window=4)
+
+        #chunks after the failed one were in flight, so the update started over
+        self.assertEqual(session.report.restarts, 1)
+        self.assertEqual([name for name, seconds in session.report.phases][:4],
+                         ["activation", "start", "init", "transfer"])
+        self.assertEqual([name for name, seconds in session.report.phases].count("start"), 2)
+        self.assertEqual(sim.images[0].data, data)
+
+    def test_window_drop(self):
+        #192 byte chunks, 43 to the image and 22 up to the first sync point
+        packed, data = appImage(8192)
+        with RigDfuSim(faults={2: None}) as sim:
+            session = self.update(sim, parseImage(packed), window=4, chunkTimeout=0.2)
+
+        #the lost answer is noticed at the sync point, not at the end of the image
+        self.assertEqual(session.report.restarts, 1)
+        self.assertEqual(session.report.chunks, 22 + 43)
+        self.assertEqual(sim.images[0].data, data)
+
+    def test_retries_exhausted(self):
+        packed, data = appImage(2048)
+        faults = dict((n, Serial_Op_Status.CRC_Err) for n in range(2, 5))
+        with RigDfuSim(faults=faults) as sim:
+            with self.assertRaises(DfuError):
+                self.update(sim, parseImage(packed), retries=2)
+            #gave up at the failing chunk rather than sending the rest
+            self.assertEqual(sim.chunks, 5)
+
+    def test_fatal_status(self):
+        packed, data = appImage(2048)
+        with RigDfuSim(faults={1: Serial_Op_Status.Op_Failed_Err}) as sim:
+            with self.assertRaises(DfuError):
+                self.update(sim, parseImage(packed))
+            self.assertEqual(sim.chunks, 2)
+
+    def test_patch(self):
+        old = os.urandom(4096)
+        new = bytearray(old)
+        new[100:108] = os.urandom(8)
+        new[2000:2000] = os.urandom(64)
+        patch, stats = rigpatch.makePatch(old, bytes(new))
+
+        with RigDfuSim(app=old) as sim:
+            self.update(sim, parseImage(patch))
+        self.assertTrue(sim.images[0].patch)
+        self.assertEqual(sim.images[0].data, bytes(new))
+
+        with RigDfuSim(app=bytes(new)) as sim:
+            with self.assertRaises(DfuError):
+                self.update(sim, parseImage(patch))
+
+    def test_patch_input_full(self):
+        old = os.urandom(8192)
+        new = os.urandom(2048) + old[2048:]
+        patch, stats = rigpatch.makePatch(old, new)
+
+        #the buffer holds two chunks and drains slower than they arrive
+        with RigDfuSim(app=old, patchBuffer=2 * 128, patchRate=4000) as sim:
+            session = self.update(sim, parseImage(patch), chunk=128, window=4)
+        self.assertEqual(sim.images[0].data, new)
+        self.assertGreater(sim.inputFull, 0)
+        self.assertEqual(session.report.inputFull, sim.inputFull)
+        self.assertEqual(session.report.retries, 0)
+
+    def test_patch_input_full_fault(self):
+        old = os.urandom(4096)
+        new = old[:1000] + os.urandom(500) + old[1500:]
+        patch, stats = rigpatch.makePatch(old, new)
+
+        faults = {0: Serial_Op_Status.Patch_Input_Full, 1: Serial_Op_Status.Patch_Input_Full}
+        with RigDfuSim(app=old, faults=faults) as sim:
+            session = self.update(sim, parseImage(patch), chunk=64)
+        self.assertEqual(sim.images[0].data, new)
+        self.assertEqual(session.report.inputFull, 2)
+
+    def test_firmware_info(self):
+        image = parseImage(imagebuild.ImageBuilder().build([BOOTLOADER], "nrf52832-sd132v3.x.0"))
+        self.assertEqual(image.info.banner(), "3.3.1 (46)")
+        self.assertEqual((image.info.versionType, image.info.hwSupport, image.info.protocol), (1, 2, 3))
+
+        #the same struct built with 4 byte enums
+        info = struct.pack('<LLBBBLLLLHL', 0x465325D4, 33, 1, 2, 3, 4, 1, 4, 2, 3, 0x49B0784C)
+        self.assertEqual(parseFirmwareInfo(info).banner(), "1.2.3 (4)")
+        self.assertIsNone(parseFirmwareInfo(info[:-1] + b'\x00'))
+
+        packed, data = appImage()
+        self.assertIsNone(parseImage(packed).info)
+
+    def test_skip_current(self):
+        image = parseImage(imagebuild.ImageBuilder().build([BOOTLOADER], "nrf52832-sd132v3.x.0"))
+        options = argparse.Namespace(baud=115200, baudcache=self.baudCache, chunk="192", window=1,
+                                     retries=3, skipcurrent=True)
+        log = lambda level, msg: None
+
+        with RigDfuSim(version="3.3.1 (46)") as sim:
+            self.assertEqual(run(dfu.updateDevice(sim.port, options, image, log)), 0)
+        self.assertEqual(sim.images, [])
+
+        with RigDfuSim(version="3.2.3 (45)", throttle=False) as sim:
+            self.assertEqual(run(dfu.updateDevice(sim.port, options, image, log)), 1)
+        self.assertEqual(len(sim.images), 1)
+
+    def test_baud_auto(self):
+        with RigDfuSim(maxBaud=460800) as sim:
+            async def go():
+                async with DfuSession(sim.port, baud="auto", baudCache=self.baudCache) as session:
+                    return session.activeBaud
+            self.assertEqual(run(go()), 460800)
+
+    def test_baud_cache_invalid(self):
+        with RigDfuSim(maxBaud=230400) as sim:
+            with open(self.baudCache, "w") as f:
+                json.dump({sim.port: "fast", "/dev/other": -1, "/dev/ok": 460800}, f)
+            self.assertEqual(baudrate.loadCache(self.baudCache), {"/dev/ok": 460800})
+
+            #a cached rate that can't be opened falls back to negotiating
+            baudrate.updateCache(self.baudCache, sim.port, 460800)
+            activate = DfuSession._activate
+            rates = []
+            async def failCached(session, baud, timeout_s=1.0):
+                rates.append(baud)
+                if len(rates) == 1:
+                    raise DfuError("openSerial - RigDFU initialization error: busy")
+                return await activate(session, baud, timeout_s)
+
+            async def go():
+                async with DfuSession(sim.port, baud="auto", baudCache=self.baudCache) as session:
+                    return session.activeBaud
+            with mock.patch.object(DfuSession, "_activate", failCached):
+                self.assertEqual(run(go()), 230400)
+            self.assertEqual(rates[:2], [460800, baudrate.SAFE_BAUD])
+            self.assertEqual(baudrate.loadCache(self.baudCache)[sim.port], 230400)
+
+class TestSerialLink(unittest.TestCase):
+
+    def test_write_error(self):
+        class Unplugged(object):
+            in_waiting = 0
+            def write(self, data):
+                raise serial.SerialException("write failed: [Errno 5] Input/output error")
+            def read(self, size):
+                return b''
+            def close(self):
+                pass
+
+        async def go():
+            link = SerialLink(Unplugged(), asyncio.get_running_loop())
+            try:
+                link.write(b'\x00')
+            finally:
+                link.close()
+        with self.assertRaises(DfuError) as cm:
+            run(go())
+        self.assertIn("serial write failed", str(cm.exception))
+
+if __name__ == '__main__':
+    unittest.main()